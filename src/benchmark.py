@@ -0,0 +1,337 @@
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import threading
+import time
+import timeit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import util.capture as capture
+import util.utils as utils
+import util.validators as validators
+
+# Micro-benchmarks of the request layer (util/validators): batch splitting, JSON decoding, HTTP clients and get_json,
+# with payloads of 50, 100 and 500 validators. The optional clients and decoders are used only if they are installed
+#   i.e. python src/benchmark.py
+#        python src/benchmark.py --capture capture.jsonl.gz --requests 500
+
+BATCH_SIZES = [50, 100, 500]
+FLEET_SIZES = [1000, 10000, 100000]
+
+# Kind of responses (dashboard state, effectiveness and validator info), and the request path of each one
+KINDS = ["state", "effectiveness", "validator"]
+
+
+def get_state_row(index):
+    # Row of /dashboard/data/validators (the status is in position 3)
+    return [
+        "0x" + f"{index:096x}",
+        index,
+        [32012345678, 32000000000],
+        "active_online",
+        [123456, 1700000000],
+        None,
+        [123460, 1700000384, 32000000000],
+        [[8000000 + index, 1700000400]],
+        [0, 0],
+        [3, 0],
+        [0, 0],
+    ]
+
+
+def get_effectiveness_item(index):
+    return {"validatorindex": index, "attestation_efficiency": 1.0123456789}
+
+
+def get_validator_item(index):
+    return {
+        "activationeligibilityepoch": 123000,
+        "activationepoch": 123456,
+        "balance": 32012345678,
+        "effectivebalance": 32000000000,
+        "exitepoch": 9223372036854775807,
+        "lastattestationslot": 8000000 + index,
+        "name": "",
+        "pubkey": "0x" + f"{index:096x}",
+        "slashed": False,
+        "status": "active_online",
+        "validatorindex": index,
+        "withdrawableepoch": 9223372036854775807,
+        "withdrawalcredentials": "0x01" + "0" * 22 + f"{index:040x}",
+        "total_withdrawals": 123456789,
+    }
+
+
+PAYLOAD_ITEMS = {
+    "state": get_state_row,
+    "effectiveness": get_effectiveness_item,
+    "validator": get_validator_item,
+}
+
+
+def generate_payloads():
+    # Synthetic responses, with the size of the real ones
+    return {
+        (kind, batch_size): json.dumps(
+            {
+                "status": "OK",
+                "data": [get_item(index) for index in range(1, batch_size + 1)],
+            }
+        ).encode()
+        for kind, get_item in PAYLOAD_ITEMS.items()
+        for batch_size in BATCH_SIZES
+    }
+
+
+def get_kind(path):
+    if path.startswith("/validators?validators="):
+        return "state"
+    if path.endswith("/attestationeffectiveness"):
+        return "effectiveness"
+    if path.startswith("/validator/") and not path.startswith("/validator/eth1/"):
+        return "validator"
+    return None
+
+
+def load_payloads(capture_file):
+    """
+    Uses the responses of a capture (see replay.py), grouped by kind and batch size. The missing ones are generated
+    """
+    payloads = generate_payloads()
+    recorded = set()
+    for record in capture.read_records(capture_file):
+        kind = get_kind(record["path"])
+        response = record["response"]
+        if kind is None or response is None or not isinstance(
+            response.get("data", None), list
+        ):
+            continue
+
+        # Use the first recorded response of every batch size
+        for batch_size in BATCH_SIZES:
+            key = (kind, batch_size)
+            if len(response["data"]) == batch_size and key not in recorded:
+                payloads[key] = json.dumps(response).encode()
+                recorded.add(key)
+
+    print(f"Using {len(recorded)} recorded payloads from {capture_file}")
+    return payloads
+
+
+def get_decoders():
+    decoders = {"json": json.loads}
+    try:
+        import orjson
+
+        decoders["orjson"] = orjson.loads
+    except ImportError:
+        pass
+    try:
+        import ujson
+
+        decoders["ujson"] = ujson.loads
+    except ImportError:
+        pass
+    return decoders
+
+
+def start_server(payloads):
+    """
+    Local HTTP server (keep-alive) answering /api/v1/bench/<kind>/<batch size> with the payloads
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        # Send the headers and the body right away (Nagle's algorithm delays the keep-alive responses)
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            _, kind, batch_size = self.path.rsplit("/", 2)
+            body = payloads[(kind, int(batch_size))]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def print_row(*columns):
+    print("  " + "".join(f"{column:<22}" for column in columns))
+
+
+def measure(func, requests_count):
+    timings = []
+    for _ in range(requests_count):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def print_timings(name, batch_size, timings, elapsed=None):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    elapsed = elapsed if elapsed is not None else sum(timings)
+    print_row(
+        name,
+        batch_size,
+        f"{statistics.median(timings) * 1000:.2f} ms",
+        f"{p95 * 1000:.2f} ms",
+        f"{len(timings) / elapsed:.0f} req/s",
+    )
+
+
+def benchmark_batching():
+    print("\nBatch splitting (divide_list_in_batches + request params)")
+    print_row("validators", "batch size", "time")
+    for fleet_size in FLEET_SIZES:
+        fleet = list(range(fleet_size))
+        for batch_size in BATCH_SIZES:
+
+            def split():
+                return [
+                    ",".join([str(index) for index in batch])
+                    for batch in utils.divide_list_in_batches(fleet, batch_size)
+                ]
+
+            runs, seconds = timeit.Timer(split).autorange()
+            print_row(fleet_size, batch_size, f"{seconds / runs * 1000:.3f} ms")
+
+
+def benchmark_decoders(payloads):
+    print("\nJSON decoding")
+    print_row("kind", "batch size", "size", *get_decoders())
+    for kind in KINDS:
+        for batch_size in BATCH_SIZES:
+            payload = payloads[(kind, batch_size)]
+            results = []
+            for decode in get_decoders().values():
+                runs, seconds = timeit.Timer(lambda: decode(payload)).autorange()
+                results.append(f"{seconds / runs * 1e6:.0f} µs")
+            print_row(kind, batch_size, f"{len(payload) / 1024:.0f} KiB", *results)
+
+
+def benchmark_http_clients(url, requests_count, concurrency):
+    print(f"\nHTTP clients ({requests_count} requests of validators state)")
+    print_row("client", "batch size", "p50", "p95", "throughput")
+    session = requests.Session()
+    clients = {
+        "requests": lambda url: requests.get(url).content,
+        "requests.Session": lambda url: session.get(url).content,
+    }
+    try:
+        import httpx
+
+        httpx_client = httpx.Client()
+        clients["httpx.Client"] = lambda url: httpx_client.get(url).content
+    except ImportError:
+        httpx = None
+
+    for batch_size in BATCH_SIZES:
+        request_url = f"{url}/api/v1/bench/state/{batch_size}"
+        for name, get in clients.items():
+            timings = measure(lambda: get(request_url), requests_count)
+            print_timings(name, batch_size, timings)
+
+        if httpx is not None:
+            timings, elapsed = asyncio.run(
+                benchmark_async_client(request_url, requests_count, concurrency)
+            )
+            print_timings(
+                f"httpx.AsyncClient x{concurrency}", batch_size, timings, elapsed
+            )
+
+
+async def benchmark_async_client(url, requests_count, concurrency):
+    import httpx
+
+    timings = []
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient() as client:
+
+        async def get():
+            async with semaphore:
+                started = time.perf_counter()
+                await client.get(url)
+                timings.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[get() for _ in range(requests_count)])
+        elapsed = time.perf_counter() - started
+    return timings, elapsed
+
+
+def benchmark_get_json(url, requests_count):
+    print(f"\nget_json ({requests_count} requests of validators state, with retries and instrumentation)")
+    print_row("http_client/decoder", "batch size", "p50", "p95", "throughput")
+    decoders = [decoder for decoder in validators.JSON_DECODERS if decoder in get_decoders()]
+    for http_client in validators.HTTP_CLIENTS:
+        for json_decoder in decoders:
+            utils.config_cache = {
+                "beacon_chain": {
+                    "base_url": url,
+                    "http_client": http_client,
+                    "json_decoder": json_decoder,
+                }
+            }
+            validators.reset_config()
+            for batch_size in BATCH_SIZES:
+                timings = measure(
+                    lambda: validators.get_json(f"/bench/state/{batch_size}"),
+                    requests_count,
+                )
+                print_timings(f"{http_client}/{json_decoder}", batch_size, timings)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the request layer: batch splitting, JSON decoders, HTTP clients and get_json"
+    )
+    parser.add_argument(
+        "--capture",
+        default=None,
+        help="Use the responses of a capture file (i.e. capture.jsonl.gz) instead of synthetic ones",
+    )
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Number of requests per measure"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Concurrent requests of the async clients",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    payloads = (
+        load_payloads(args.capture) if args.capture is not None else generate_payloads()
+    )
+    server, url = start_server(payloads)
+    try:
+        benchmark_batching()
+        benchmark_decoders(payloads)
+        benchmark_http_clients(url, args.requests, args.concurrency)
+        benchmark_get_json(url, args.requests)
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
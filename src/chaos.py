@@ -0,0 +1,518 @@
+import argparse
+import asyncio
+import contextvars
+import datetime
+import logging
+import random
+import subprocess
+import sys
+import time
+import types
+
+import util.utils as utils
+import util.messages as messages
+import util.validators as validators
+
+# Chaos/load test of the main loop (watchdog, error thresholds and retries) against a fake Beacon Chain API and a fake
+# Telegram bot. The time is virtual, so hours of failures run in seconds
+#   i.e. python src/chaos.py --scenario all
+#        python src/chaos.py --scenario rate_limit_storm --validators 5000
+
+# Status of the fake validators
+ONLINE_STATUS = "active_online"
+OFFLINE_STATUS = "active_offline"
+
+# Validators going offline (and back online) in every scenario, to check the alerts under load
+OFFLINE_VALIDATORS_EVERY = 100
+OFFLINE_FROM_MINUTES = 10
+OFFLINE_UNTIL_MINUTES = 40
+
+REAL_DATETIME = datetime.datetime
+
+
+class Fault:
+    """
+    Failure injected between two moments of the scenario (in minutes). The target is the Beacon Chain API ("api") or
+    Telegram ("telegram")
+    """
+
+    def __init__(
+        self, start, end, latency=0, error_rate=0, error=None, target="api"
+    ):
+        self.start = start * 60
+        self.end = end * 60
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error = error
+        self.target = target
+
+    def is_active(self, elapsed, target):
+        return self.target == target and self.start <= elapsed < self.end
+
+
+# Service level objectives of the monitor: no watchdog restarts, and the checks well below the watchdog limit
+# ("watch_dog_kill_switch_minutes" in get_config)
+CHECK_SLO_SECONDS = 600
+# Size of the fleet of the scenarios. The duration of the checks grows with the number of batches, so the
+# expectations only hold at the size of the scenario (--validators runs a load test, without checking them)
+VALIDATORS = 1000
+
+# Scenarios: injected faults, and the expected behavior of the monitor at its fleet size ("validators", VALIDATORS by
+# default). The known failures are gaps of the monitor (expectation -> reason): they are reported, but don't fail the run
+SCENARIOS = {
+    "baseline": {
+        "description": "No failures",
+        "minutes": 60,
+        "faults": [],
+        "expect": {"watchdog": False, "max_cycle_seconds": 60, "max_error_alerts": 0},
+    },
+    "latency_spikes": {
+        "description": "The API responses take 5s for 10 minutes every half an hour",
+        "minutes": 120,
+        "faults": [
+            Fault(start, start + 10, latency=5) for start in range(15, 120, 30)
+        ],
+        "expect": {
+            "watchdog": False,
+            "max_cycle_seconds": CHECK_SLO_SECONDS,
+            "max_error_alerts": 0,
+        },
+    },
+    "partial_outage": {
+        "description": "30% of the API requests fail for an hour, and Telegram is down for 5 minutes",
+        "minutes": 120,
+        "faults": [
+            Fault(20, 80, error_rate=0.3, error="503 Service Unavailable"),
+            # The offline alert is due in the middle of the Telegram outage (retried by send_message)
+            Fault(13, 18, error_rate=1, error="Telegram unavailable", target="telegram"),
+        ],
+        "expect": {
+            "watchdog": False,
+            "max_cycle_seconds": CHECK_SLO_SECONDS,
+            "max_error_alerts": 0,
+        },
+    },
+    "flaky_batches": {
+        # Some batches give up after retrying, so their validators are not observed (stale data)
+        "description": "80% of the API requests fail for 30 minutes",
+        "minutes": 120,
+        "faults": [Fault(20, 50, error_rate=0.8, error="502 Bad Gateway")],
+        "expect": {
+            "watchdog": False,
+            "max_cycle_seconds": CHECK_SLO_SECONDS,
+            "max_error_alerts": 0,
+            "min_stale_alerts": 1,
+        },
+        "known_failures": {
+            "max_cycle_seconds": "The failed batches retry for up to 2 minutes each (backoff in get_json), so the check lasts for most of the failures",
+        },
+    },
+    "rate_limit_storm": {
+        "description": "95% of the API requests are rate limited (429) for 20 minutes",
+        "minutes": 120,
+        "faults": [Fault(20, 40, error_rate=0.95, error="429 Too Many Requests")],
+        "expect": {
+            "watchdog": False,
+            "max_cycle_seconds": CHECK_SLO_SECONDS,
+            "max_error_alerts": 0,
+        },
+        "known_failures": {
+            "max_cycle_seconds": "Every batch retries for up to 2 minutes (backoff in get_json), so the check is stuck for the whole storm",
+        },
+    },
+    "full_outage": {
+        "description": "The API is down for an hour",
+        "minutes": 120,
+        "faults": [Fault(20, 80, error_rate=1, error="503 Service Unavailable")],
+        "expect": {
+            "watchdog": False,
+            "max_cycle_seconds": CHECK_SLO_SECONDS,
+            "min_error_alerts": 1,
+        },
+        "known_failures": {
+            "watchdog": "The check is stuck retrying the batches until the watchdog restarts the monitor",
+            "max_cycle_seconds": "Every batch retries for up to 2 minutes (backoff in get_json)",
+            "min_error_alerts": "The failed batches don't fail the check, so the outage never reaches notify_error_count_thresholds",
+        },
+    },
+}
+
+
+class VirtualClock:
+    """
+    Virtual time, advanced by the event loop when it's idle. The blocking calls (run inline instead of in a thread)
+    accumulate the time they sleep, which is awaited once they return
+    """
+
+    def __init__(self):
+        self.loop_time = 0.0
+        self.epoch = time.time()
+        self.pending_delay = contextvars.ContextVar("pending_delay", default=None)
+
+    def advance(self, seconds):
+        self.loop_time += seconds
+
+    def monotonic(self):
+        pending_delay = self.pending_delay.get()
+        return self.loop_time + (pending_delay[0] if pending_delay else 0)
+
+    def time(self):
+        return self.epoch + self.monotonic()
+
+    def sleep(self, seconds):
+        pending_delay = self.pending_delay.get()
+        if pending_delay is None:
+            self.advance(seconds)
+        else:
+            pending_delay[0] += seconds
+
+    def now(self, tz=None):
+        return REAL_DATETIME.fromtimestamp(self.time(), tz)
+
+    async def run_inline(self, func, *args, **kwargs):
+        # Replaces utils.run_in_thread: Runs the function, and then waits for the virtual time it took
+        pending_delay = [0.0]
+        token = self.pending_delay.set(pending_delay)
+        result, exception = None, None
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            exception = e
+        finally:
+            self.pending_delay.reset(token)
+
+        await asyncio.sleep(pending_delay[0])
+        if exception is not None:
+            raise exception
+        return result
+
+    def install(self):
+        clock = self
+
+        class VirtualDatetime(REAL_DATETIME):
+            @classmethod
+            def now(cls, tz=None):
+                return clock.now(tz)
+
+        time.time = self.time
+        time.monotonic = self.monotonic
+        time.perf_counter = self.monotonic
+        time.sleep = self.sleep
+        datetime.datetime = VirtualDatetime
+        utils.run_in_thread = self.run_inline
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop that jumps to the next scheduled callback instead of waiting for it
+    """
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+        select = self._selector.select
+
+        def virtual_select(timeout=None):
+            if timeout is not None and timeout > 0:
+                clock.advance(timeout)
+            return select(0)
+
+        self._selector.select = virtual_select
+
+    def time(self):
+        return self.clock.loop_time
+
+
+class FakeBeaconChainApi:
+    """
+    Fake Beacon Chain API for a fleet of validators, with the faults of the scenario
+    """
+
+    def __init__(self, clock, validators_total, faults):
+        self.clock = clock
+        self.validators_total = validators_total
+        self.faults = faults
+        self.requests = 0
+        self.failed_requests = 0
+
+    def get_status(self, index):
+        elapsed_minutes = self.clock.monotonic() / 60
+        if (
+            index % OFFLINE_VALIDATORS_EVERY == 0
+            and OFFLINE_FROM_MINUTES <= elapsed_minutes < OFFLINE_UNTIL_MINUTES
+        ):
+            return OFFLINE_STATUS
+        return ONLINE_STATUS
+
+    def request_json(self, path, base_api):
+        # Replaces validators.request_json
+        self.requests += 1
+        faults = [
+            fault
+            for fault in self.faults
+            if fault.is_active(self.clock.monotonic(), "api")
+        ]
+
+        latency = 0.1 + sum(fault.latency for fault in faults)
+        time.sleep(min(latency, validators.REQUEST_TIMEOUT))
+        if latency > validators.REQUEST_TIMEOUT:
+            self.failed_requests += 1
+            raise Exception("Read timed out")
+
+        for fault in faults:
+            if random.random() < fault.error_rate:
+                self.failed_requests += 1
+                raise Exception(fault.error)
+
+        if path.startswith("/validator/eth1/"):
+            return {
+                "data": [
+                    {"validatorindex": index}
+                    for index in range(1, self.validators_total + 1)
+                ]
+            }
+
+        if path.startswith("/validators?validators="):
+            indexes = [int(index) for index in path.split("=")[1].split(",")]
+            return {
+                "data": [
+                    [None, index, None, self.get_status(index)] for index in indexes
+                ]
+            }
+
+        if path.endswith("/attestationeffectiveness"):
+            indexes = [int(index) for index in path.split("/")[2].split(",")]
+            return {
+                "data": [
+                    {"validatorindex": index, "attestation_efficiency": 1}
+                    for index in indexes
+                ]
+            }
+
+        raise Exception(f"Unexpected request: {base_api}{path}")
+
+
+class FakeTelegramBot:
+    """
+    Fake Telegram bot. Keeps the messages sent (with their virtual time)
+    """
+
+    def __init__(self, clock, faults):
+        self.clock = clock
+        self.faults = faults
+        self.messages = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def get_me(self):
+        return types.SimpleNamespace(username="chaos", first_name="Chaos Bot")
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        for fault in self.faults:
+            if fault.is_active(self.clock.monotonic(), "telegram"):
+                await asyncio.sleep(fault.latency)
+                if random.random() < fault.error_rate:
+                    raise Exception(fault.error)
+        self.messages.append((self.clock.monotonic(), text))
+
+
+def get_config():
+    return {
+        "check_health": {
+            "polling_wait": 60,
+            "batch_request_delay": 0.2,
+            "notify_delay_seconds": 300,
+            "watch_dog_kill_switch_minutes": 30,
+            "notify_error_count_thresholds": [15, 60, 1440],
+            # A check can last for the whole outage, so notify the stale validators after the first check missing them
+            "notify_stale_cycles": 1,
+        },
+        "beacon_chain": {"base_url": "https://chaos.test"},
+        "validators": {"eth1_withdraw_account": "0xchaos"},
+    }
+
+
+def get_percentile(values, percentile):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile))]
+
+
+def run_scenario(name, validators_total, seed):
+    import main as app
+
+    scenario = SCENARIOS[name]
+    validators_total = validators_total or get_validators(scenario)
+    random.seed(seed)
+
+    # Virtual time
+    clock = VirtualClock()
+    clock.install()
+    loop = VirtualTimeLoop(clock)
+    asyncio.set_event_loop(loop)
+
+    # Fake config, API and Telegram
+    utils.CONFIG_FILE = None
+    utils.config_cache = get_config()
+    api = FakeBeaconChainApi(clock, validators_total, scenario["faults"])
+    validators.request_json = api.request_json
+    bot = FakeTelegramBot(clock, scenario["faults"])
+    messages.chat_id, messages.bot, messages.bot_initialized = "chaos", bot, True
+
+    # Measure the duration of every check
+    cycle_seconds = []
+    check = app.check
+
+    async def timed_check(*args):
+        started = clock.monotonic()
+        try:
+            await check(*args)
+        finally:
+            cycle_seconds.append(clock.monotonic() - started)
+
+    app.check = timed_check
+
+    # Run the monitor for the duration of the scenario
+    real_started = REAL_DATETIME.now()
+    loop.call_later(scenario["minutes"] * 60, app.stop, "end of scenario")
+    loop.run_until_complete(app.run())
+    loop.close()
+    real_seconds = (REAL_DATETIME.now() - real_started).total_seconds()
+
+    return report(name, scenario, validators_total, clock, api, bot, cycle_seconds, app.exit_code, real_seconds)
+
+
+def get_validators(scenario):
+    return scenario.get("validators", VALIDATORS)
+
+
+def report(name, scenario, validators_total, clock, api, bot, cycle_seconds, exit_code, real_seconds):
+    messages_sent = [text for _, text in bot.messages]
+    error_alerts = [text for text in messages_sent if "*ERROR*" in text]
+    offline_alerts = [text for text in messages_sent if "*OFFLINE*" in text]
+    watchdog_alerts = [text for text in messages_sent if "*WATCH DOG*" in text]
+    stale_alerts = [text for text in messages_sent if "⌛" in text]
+    watchdog = exit_code == 100
+    results = {
+        "watchdog": watchdog,
+        "max_cycle_seconds": round(max(cycle_seconds, default=0), 1),
+        "max_error_alerts": len(error_alerts),
+        "min_error_alerts": len(error_alerts),
+        "min_stale_alerts": len(stale_alerts),
+    }
+
+    print(f"\nScenario {name}: {scenario['description']} ({validators_total} validators)")
+    print(
+        f"  Simulated {clock.monotonic() / 60:.0f} minutes in {real_seconds:.1f}s"
+        + (" (the watchdog restarted the monitor)" if watchdog else "")
+    )
+    print(f"  API requests: {api.requests} ({api.failed_requests} failed)")
+    print(
+        f"  Checks: {len(cycle_seconds)} (p50 {get_percentile(cycle_seconds, 0.5):.1f}s, p95 {get_percentile(cycle_seconds, 0.95):.1f}s, max {results['max_cycle_seconds']:.1f}s)"
+    )
+    print(
+        f"  Telegram messages: {len(messages_sent)} ({len(error_alerts)} error alerts, {len(offline_alerts)} offline alerts, {len(watchdog_alerts)} watchdog alerts, {len(stale_alerts)} stale alerts)"
+    )
+
+    # Check the expectations. The known failures that pass are reported too, so they are removed once fixed. A load test
+    # (at another fleet size) only reports them
+    load_test = validators_total != get_validators(scenario)
+    failures = []
+    known_failures = scenario.get("known_failures", {})
+    for key, expected in scenario["expect"].items():
+        value = results[key]
+        if key == "watchdog":
+            ok = value == expected
+        elif key.startswith("min_"):
+            ok = value >= expected
+        else:
+            ok = value <= expected
+
+        if key in known_failures:
+            print(
+                f"  KNOWN FAILURE {key}: expected {expected}, got {value}"
+                + (
+                    f". {known_failures[key]}"
+                    if not ok
+                    else ", passed" if load_test else ", passed (remove it from known_failures if it's fixed)"
+                )
+            )
+        elif not ok:
+            failures.append(f"{key}: expected {expected}, got {value}")
+
+    if not offline_alerts:
+        failures.append("offline alerts: expected at least one, got none")
+    if watchdog and not watchdog_alerts:
+        failures.append("watchdog alerts: expected at least one, got none")
+
+    if load_test:
+        for failure in failures:
+            print(f"  MISSED {failure}")
+        print(f"  DONE (expectations checked at {get_validators(scenario)} validators only)")
+        return True
+
+    for failure in failures:
+        print(f"  FAIL {failure}")
+    print(f"  {'FAIL' if failures else 'PASS'}")
+    return not failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Chaos/load test of the monitor against a fake Beacon Chain API and Telegram, in virtual time"
+    )
+    parser.add_argument(
+        "--scenario",
+        default="all",
+        choices=list(SCENARIOS) + ["all"],
+        help="Scenario to run (all runs each one in its own process)",
+    )
+    parser.add_argument(
+        "--validators",
+        type=int,
+        help="Number of validators of a load test, without checking the expectations (by default, the size of every scenario)",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser.add_argument(
+        "--log-level", default="CRITICAL", help="Log level of the monitor"
+    )
+    return parser.parse_args()
+
+
+def run_all(args):
+    failed = []
+    for name in SCENARIOS:
+        result = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--scenario",
+                name,
+                "--seed",
+                str(args.seed),
+                "--log-level",
+                args.log_level,
+            ]
+            + (["--validators", str(args.validators)] if args.validators else [])
+        )
+        if result.returncode != 0:
+            failed.append(name)
+
+    print(f"\n{len(SCENARIOS) - len(failed)}/{len(SCENARIOS)} scenarios passed")
+    return not failed
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for logger in ("", "backoff"):
+        logging.getLogger(logger).setLevel(args.log_level)
+    if args.scenario == "all":
+        ok = run_all(args)
+    else:
+        ok = run_scenario(args.scenario, args.validators, args.seed)
+    sys.exit(0 if ok else 1)
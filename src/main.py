@@ -1,26 +1,47 @@
+import time
+
+startup_time = time.perf_counter()
+
 import asyncio
 import signal
-from threading import Event
 import traceback
 
 import util.validators as validators
 import util.messages as messages
+import util.alerts as alerts
 import util.utils as utils
 import monitor.monitor_status as monitor_status
 import monitor.monitor_effectiveness as monitor_effectiveness
+import monitor.monitor_duties as monitor_duties
+import monitor.lifecycle as lifecycle
 import util.prometheus as prometheus
+import util.api as api
+import util.capture as capture
+import util.tracing as tracing
 import datetime
 import sys
 
 
 log = utils.getLog(__name__)
-exit_event = Event()
-wait = None
+exit_event = None
+config_reloaded_event = None
+settings = None
 
 # State
 exit_code = 0
 error_count = 0
 last_success = None
+backfill_retry_task = None
+
+# Max time waiting for the goodbye message when shutting down
+GOODBYE_TIMEOUT_SECONDS = 5
+
+# Interval to check if the config file changed
+CONFIG_RELOAD_SECONDS = 10
+
+# Backoff to retry the public keys that couldn't be resolved on startup (seconds)
+BACKFILL_RETRY_SECONDS = 30
+BACKFILL_RETRY_MAX_SECONDS = 600
 
 
 # "check_health": {
@@ -34,153 +55,621 @@ last_success = None
 
 
 @prometheus.check_time_summary.time()
-async def check(validator_monitor, validator_effectiveness):
+async def check(validator_monitor, validator_effectiveness, validator_duties):
     # Monitor validators
-    await validator_monitor.check()
-    await validator_effectiveness.check()
+    with tracing.trace_check():
+        with tracing.span("check_status"):
+            await validator_monitor.check()
+        with tracing.span("check_effectiveness"):
+            await validator_effectiveness.check()
+        if validator_duties is not None:
+            with tracing.span("check_duties"):
+                await validator_duties.check()
+
+
+def get_settings(config):
+    check_health_config = config.get("check_health", {})
+    return {
+        "polling_wait": check_health_config.get("polling_wait", 60),
+        "batch_request_delay": check_health_config.get("batch_request_delay", 0.2),
+        "notify_delay_seconds": check_health_config.get("notify_delay_seconds", 300),
+        "watch_dog_kill_switch_minutes": check_health_config.get(
+            "watch_dog_kill_switch_minutes", 30
+        ),
+        "notify_effectiveness_threshold": check_health_config.get(
+            "notify_effectiveness_threshold", None
+        ),
+        "notify_error_count_thresholds": check_health_config.get(
+            "notify_error_count_thresholds", [15, 60, 1440]
+        ),
+        "shutdown_timeout_seconds": check_health_config.get(
+            "shutdown_timeout_seconds", 0.5
+        ),
+        "terminal_polling_cycles": check_health_config.get(
+            "terminal_polling_cycles", 60
+        ),
+        "pending_polling_cycles": check_health_config.get("pending_polling_cycles", 10),
+        "hot_polling_wait": check_health_config.get("hot_polling_wait", 15),
+        "hot_window_seconds": check_health_config.get("hot_window_seconds", 600),
+        "hot_max_validators": check_health_config.get("hot_max_validators", 50),
+        "check_duties": check_health_config.get("check_duties", False),
+        "sync_participation_threshold": check_health_config.get(
+            "sync_participation_threshold", 0.8
+        ),
+        "backfill_concurrency": check_health_config.get("backfill_concurrency", 4),
+        "notify_stale_cycles": check_health_config.get("notify_stale_cycles", None),
+        "backfill_wait_seconds": check_health_config.get("backfill_wait_seconds", 30),
+    }
+
+
+def get_hot_max_validators(settings):
+    # Hot polling is disabled if there's no "hot_polling_wait"
+    if settings["hot_polling_wait"] is None:
+        return 0
+    return settings["hot_max_validators"]
 
 
 async def main():
-    global wait, error_count, last_success
-    
+    global last_success, settings
+
+    # Load the config (the modules read it lazily)
+    utils.load_config()
+
+    # Record (or replay) the requests to the Beacon Chain API
+    capture.setup(utils.config.get("capture", None))
+    if capture.replayer is not None:
+        messages.disable_notifications()
+
+    # Instrumentation of the check
+    tracing.setup(utils.config.get("profiling", None))
+
+    # Routing of the alerts
+    alerts.setup(utils.config.get("alerts", None))
+
     # Config: Health check
-    check_health_config = utils.config.get("check_health", {})
-    polling_wait = check_health_config.get("polling_wait", 60)
-    batch_request_delay = check_health_config.get("batch_request_delay", 0.2)
-    notify_delay_seconds = check_health_config.get("notify_delay_seconds", 300)
-    watch_dog_kill_switch_minutes = check_health_config.get("watch_dog_kill_switch_minutes", 30)
-    notify_effectiveness_threshold = check_health_config.get(
-        "notify_effectiveness_threshold", None
-    )
-    notify_error_count_thresholds = check_health_config.get(
-        "notify_error_count_thresholds", [15, 60, 1440]
-    )
-    error_count_max_notify_threshold = notify_error_count_thresholds[-1]
+    settings = get_settings(utils.config)
+    shutdown_timeout_seconds = settings["shutdown_timeout_seconds"]
 
     # Config: Prometheus
     prometheus_config = utils.config.get("prometheus", None)
 
-    # Greet
-    user = await messages.get_user()
-    log.info('[%s] ETH2 Monitor "%s" is up', user.username, user.first_name)
-    await messages.send_message(f"☀️ Validator Monitor *RESTARTED*")
+    # Config: Query API
+    api_config = utils.config.get("api", None)
+
+    # Greet (runs concurrently with the startup and the first check)
+    greet_task = asyncio.create_task(greet())
+
+    # Start Prometheus server (before resolving the validators, so the progress of the backfill is reported)
+    if prometheus_config is not None:
+        prometheus_port = prometheus_config.get("port", None)
+        prometheus.start_http_server(prometheus_port)
+    else:
+        log.warning(
+            "Prometheus metrics won't be exposed. To expose them, add prometheus configuration"
+        )
+
+    # Get all the monitoring validators. If it takes long, start monitoring the ones resolved so far
+    backfill_task = asyncio.create_task(
+        validators.backfill_validators(
+            settings["backfill_concurrency"], settings["batch_request_delay"]
+        )
+    )
+    await wait_or_exit(backfill_task, timeout=settings["backfill_wait_seconds"])
+    if exit_event.is_set():
+        await drain(backfill_task, 0)
+        await drain(greet_task, shutdown_timeout_seconds)
+        return
 
-    # Get all the monitoring validators
-    monitored_validators = validators.get_validators()
+    if backfill_task.done() and backfill_task.exception() is None:
+        monitored_validators = backfill_task.result()
+    else:
+        # Slow or failed (it's retried in the background, see complete_backfill)
+        monitored_validators = validators.get_resolved_validators()
+        log.warning(
+            f"Resolving the validators is taking long or failed. Start monitoring the {len(monitored_validators)} validators resolved so far, and add the rest when they are resolved"
+        )
     validators_total = len(monitored_validators)
+    messages.render_validators(monitored_validators)
 
     # Report the number of validators being monitored
     prometheus.validators_total_gauge.set(validators_total)
     log.info("Monitoring %s validators: %s", validators_total, monitored_validators)
-    await messages.send_message(
-        f"Will keep an 👀 on `{len(monitored_validators)}` validators"
+    announce_task = asyncio.create_task(
+        announce(
+            greet_task,
+            f"Will keep an 👀 on `{len(monitored_validators)}` validators",
+        )
+    )
+    validators_lifecycle = lifecycle.ValidatorLifecycle(
+        terminal_polling_cycles=settings["terminal_polling_cycles"],
+        pending_polling_cycles=settings["pending_polling_cycles"],
     )
     validator_monitor = monitor_status.MonitorStatus(
         monitored_validators=monitored_validators,
-        batch_request_delay=batch_request_delay,
-        notify_delay_seconds=notify_delay_seconds,
+        batch_request_delay=settings["batch_request_delay"],
+        notify_delay_seconds=settings["notify_delay_seconds"],
+        lifecycle=validators_lifecycle,
+        hot_window_seconds=settings["hot_window_seconds"],
+        hot_max_validators=get_hot_max_validators(settings),
+        stale_cycles=settings["notify_stale_cycles"],
     )
     validator_effectiveness = monitor_effectiveness.MonitorEffectiveness(
         monitored_validators=monitored_validators,
-        notify_effectiveness_threshold=notify_effectiveness_threshold,
-        batch_request_delay=batch_request_delay,
-        notify_delay_seconds=notify_delay_seconds,
+        notify_effectiveness_threshold=settings["notify_effectiveness_threshold"],
+        batch_request_delay=settings["batch_request_delay"],
+        notify_delay_seconds=settings["notify_delay_seconds"],
+        lifecycle=validators_lifecycle,
+        stale_cycles=settings["notify_stale_cycles"],
+    )
+    validator_duties = (
+        monitor_duties.MonitorDuties(
+            monitored_validators=monitored_validators,
+            batch_request_delay=settings["batch_request_delay"],
+            notify_delay_seconds=settings["notify_delay_seconds"],
+            sync_participation_threshold=settings["sync_participation_threshold"],
+        )
+        if settings["check_duties"]
+        else None
     )
 
-    # Start Prometheus server
-    if prometheus_config is not None:
+    # Start Query API server
+    if api_config is not None:
+        api.register_monitors(validator_monitor, validator_effectiveness)
+        api_port = api_config.get("port", 8001)
+        api.start_http_server(api_port)
+
+    # Main loop
+    last_success = datetime.datetime.now()
+    watch_dog_task = asyncio.create_task(watch_dog())
+    config_watcher_task = asyncio.create_task(
+        watch_config(validator_monitor, validator_effectiveness, validator_duties)
+    )
+    hot_polling_task = asyncio.create_task(poll_hot_validators(validator_monitor))
+    digest_task = asyncio.create_task(send_digests())
+    backfill_done_task = asyncio.create_task(
+        complete_backfill(
+            backfill_task, validator_monitor, validator_effectiveness, validator_duties
+        )
+    )
+    check_task = None
+    is_first_check = True
+    try:
+        while not exit_event.is_set():
+            # Do another check
+            check_task = asyncio.create_task(
+                run_check(validator_monitor, validator_effectiveness, validator_duties)
+            )
+            await wait_or_exit(check_task)
+            if exit_event.is_set():
+                break
+
+            if is_first_check:
+                # Track the time to first check
+                startup_seconds = time.perf_counter() - startup_time
+                prometheus.startup_seconds_gauge.set(startup_seconds)
+                log.info(f"First check done {startup_seconds:.2f}s after startup")
+                is_first_check = False
+
+            polling_wait, _ = validator_monitor.get_polling_waits(
+                settings["polling_wait"], settings["hot_polling_wait"]
+            )
+            log.debug(f"Next check in {polling_wait:.0f} seconds")
+            await wait_next_check(time.monotonic(), validator_monitor)
+    finally:
+        # Let the in-flight check finish (or cancel it if it takes too long)
+        await drain(check_task, shutdown_timeout_seconds)
+        await drain(announce_task, shutdown_timeout_seconds)
+        await drain(hot_polling_task, shutdown_timeout_seconds)
+        await drain(backfill_done_task, 0)
+        await drain(backfill_retry_task, 0)
+        await drain(digest_task, 0)
+        await drain(watch_dog_task, 0)
+        await drain(config_watcher_task, 0)
+
+
+async def greet():
+    try:
+        user = await messages.get_user()
+        log.info('[%s] ETH2 Monitor "%s" is up', user.username, user.first_name)
         prometheus.config_info.info(
             {
-                "beacon_chain_base_url": validators.base_url,
+                "beacon_chain_base_url": validators.get_base_url(),
                 "telegram_notifications_enabled": "Yes"
-                if messages.bot is not None
+                if messages.is_enabled()
                 else "No",
             }
         )
-        prometheus_port = prometheus_config.get("port", None)
-        prometheus.start_http_server(prometheus_port)
-    else:
-        log.warning(
-            "Prometheus metrics won't be exposed. To expose them, add prometheus configuration"
+        await alerts.notify(alerts.RESTARTED, f"☀️ Validator Monitor *RESTARTED*")
+    except Exception:
+        log.error(traceback.format_exc())
+        log.error("Error sending the greeting message")
+
+
+async def announce(greet_task, message):
+    # Send the message after the greeting
+    await greet_task
+    try:
+        await alerts.notify(alerts.MONITORING, message)
+    except Exception:
+        log.error(traceback.format_exc())
+        log.error("Error sending the message: %s", message)
+
+
+async def complete_backfill(
+    backfill_task, validator_monitor, validator_effectiveness, validator_duties
+):
+    monitors = get_monitors(
+        validator_monitor, validator_effectiveness, validator_duties
+    )
+
+    # Add the validators resolved after the monitoring started
+    backfill_failed = False
+    started_done = backfill_task.done()
+    try:
+        monitored_validators = await backfill_task
+        if not started_done:
+            await add_backfilled_validators(monitored_validators, monitors)
+    except Exception:
+        backfill_failed = True
+        log.error(traceback.format_exc())
+        log.error("Error resolving the validators. Keep monitoring the resolved ones")
+
+    if backfill_failed or validators.failed_public_keys:
+        start_backfill_retry(monitors, backfill_failed)
+
+
+def start_backfill_retry(monitors, backfill_failed=False):
+    # Retry in the background (unless it's already retrying)
+    global backfill_retry_task
+    if backfill_retry_task is None or backfill_retry_task.done():
+        backfill_retry_task = asyncio.create_task(
+            retry_backfill(monitors, backfill_failed)
         )
 
-    # Main loop
-    last_success = datetime.datetime.now()
-    while not exit_event.is_set():
-        # Watchdog: NOTIFY and restart after 30 minutes of consecutive errors
-        if last_success < datetime.datetime.now() - datetime.timedelta(minutes=watch_dog_kill_switch_minutes):
-            minutes_scaped = utils.format_decimal(watch_dog_kill_switch_minutes)
-            watchdog_message = f"🐶 *WATCH DOG*: Last success was more than {minutes_scaped} minutes ago. Restarting!"
-            log.error(watchdog_message)
+
+async def retry_backfill(monitors, backfill_failed):
+    # Retry the public keys that couldn't be resolved (with backoff), so they don't stay unmonitored
+    retry_seconds = BACKFILL_RETRY_SECONDS
+    notified = False
+    while backfill_failed or validators.failed_public_keys:
+        unresolved = (
+            f"{len(validators.failed_public_keys)} public keys"
+            if validators.failed_public_keys
+            else "the validators"
+        )
+        if not notified:
+            notified = True
+            await alerts.notify(
+                alerts.UNRESOLVED,
+                f"⚠️ Couldn't resolve {unresolved}\\. They are not monitored yet, retrying",
+            )
+        log.warning(f"Couldn't resolve {unresolved}. Retrying in {retry_seconds}s")
+        await asyncio.sleep(retry_seconds)
+        retry_seconds = min(retry_seconds * 2, BACKFILL_RETRY_MAX_SECONDS)
+
+        try:
+            monitored_validators = await validators.backfill_validators(
+                settings["backfill_concurrency"], settings["batch_request_delay"]
+            )
+            backfill_failed = False
+            await add_backfilled_validators(monitored_validators, monitors)
+        except Exception:
+            backfill_failed = True
+            log.error(traceback.format_exc())
+            log.error("Error resolving the validators")
+
+    if notified:
+        log.info("All the validators were resolved")
+
+
+async def add_backfilled_validators(monitored_validators, monitors):
+    added_validators, _ = set_monitored_validators(monitored_validators, monitors)
+    log.info(
+        f"Backfill done. Monitoring {len(monitored_validators)} validators ({len(added_validators)} added)"
+    )
+    if added_validators:
+        await alerts.notify(
+            alerts.MONITORING,
+            f"Will keep an 👀 on `{len(monitored_validators)}` validators",
+        )
+
+
+def get_monitors(validator_monitor, validator_effectiveness, validator_duties):
+    monitors = [validator_monitor, validator_effectiveness]
+    if validator_duties is not None:
+        monitors.append(validator_duties)
+    return monitors
+
+
+def set_monitored_validators(monitored_validators, monitors):
+    """
+    Updates the validators of all the monitors. Returns the added and removed validators
+    """
+    previous_validators = set(monitors[0].monitored_validators)
+    added_validators = set(monitored_validators) - previous_validators
+    removed_validators = previous_validators - set(monitored_validators)
+    for monitor in monitors:
+        monitor.set_monitored_validators(monitored_validators)
+    messages.render_validators(monitored_validators)
+    prometheus.validators_total_gauge.set(len(monitored_validators))
+    return added_validators, removed_validators
+
+
+async def run_check(validator_monitor, validator_effectiveness, validator_duties):
+    global error_count, last_success
+    polling_wait = settings["polling_wait"]
+    notify_error_count_thresholds = settings["notify_error_count_thresholds"]
+    error_count_max_notify_threshold = notify_error_count_thresholds[-1]
+
+    try:
+        await check(validator_monitor, validator_effectiveness, validator_duties)
+        error_count = 0
+        last_success = datetime.datetime.now()
+    except Exception as e:
+        # Log errors, and notify if the errors have been happening for some consecutive runs
+        prometheus.main_loop_errors_counter.inc()
+        error_count += 1
+        log.error(traceback.format_exc())
+        log.error(
+            f"Error checking the state of validators (error_count={error_count}). Retrying in {polling_wait}s!"
+        )
+
+        # Notify if the error count is in the thresholds
+        if (
+            error_count in notify_error_count_thresholds
+            or error_count % error_count_max_notify_threshold == 0
+        ):
             try:
-                await messages.send_message(watchdog_message, scape=True)
+                await alerts.notify(
+                    alerts.ERROR,
+                    messages.scape_markdown(
+                        f"🔥 *ERROR*: The check has been failing for `{error_count}` times in a row! Cause: {repr(e)}"
+                    ),
+                )
             except Exception as e2:
                 log.error(traceback.format_exc())
                 log.error("Nested error. Error sending the Error message")
-            exit_with_code(100)
+    finally:
+        prometheus.main_loop_consecutive_errors_gauge.set(error_count)
+
+
+async def poll_hot_validators(validator_monitor):
+    # Poll the hot validators (waiting to notify, or with recent transitions) more often than the rest
+    while not exit_event.is_set():
+        _, hot_polling_wait = validator_monitor.get_polling_waits(
+            settings["polling_wait"], settings["hot_polling_wait"]
+        )
+        await wait_or_exit(
+            timeout=hot_polling_wait if hot_polling_wait is not None else CONFIG_RELOAD_SECONDS
+        )
+        if exit_event.is_set() or hot_polling_wait is None:
             continue
-            
-        # Do another check
+
         try:
-            await check(validator_monitor, validator_effectiveness)
-            error_count = 0
-            last_success = datetime.datetime.now()
-        except Exception as e:
-            # Log errors, and notify if the errors have been happening for some consecutive runs
-            prometheus.main_loop_errors_counter.inc()
-            error_count += 1
+            await validator_monitor.check_hot_validators()
+        except Exception:
             log.error(traceback.format_exc())
-            log.error(
-                f"Error checking the state of validators (error_count={error_count}). Retrying in {polling_wait}s!"
+            log.error("Error checking the hot validators")
+
+
+async def send_digests():
+    # Send the low severity alerts together, every some minutes
+    while not exit_event.is_set():
+        await wait_or_exit(timeout=alerts.digest_interval_seconds)
+        if exit_event.is_set():
+            break
+
+        try:
+            await alerts.flush_digests()
+        except Exception:
+            log.error(traceback.format_exc())
+            log.error("Error sending the alerts digest")
+
+
+async def watch_dog():
+    # Watchdog: NOTIFY and restart after some minutes of consecutive errors
+    while not exit_event.is_set():
+        watch_dog_kill_switch_minutes = settings["watch_dog_kill_switch_minutes"]
+        kill_switch = datetime.timedelta(minutes=watch_dog_kill_switch_minutes)
+        await wait_or_exit(timeout=min(kill_switch.total_seconds(), 60))
+        if exit_event.is_set() or last_success >= datetime.datetime.now() - kill_switch:
+            continue
+
+        minutes_scaped = utils.format_decimal(watch_dog_kill_switch_minutes)
+        watchdog_message = f"🐶 *WATCH DOG*: Last success was more than {minutes_scaped} minutes ago. Restarting!"
+        log.error(watchdog_message)
+        try:
+            await alerts.notify(
+                alerts.WATCHDOG, messages.scape_markdown(watchdog_message)
             )
+        except Exception as e2:
+            log.error(traceback.format_exc())
+            log.error("Nested error. Error sending the Error message")
+        exit_with_code(100)
+
 
-            # Notify if the error count is in the thresholds
-            if (
-                error_count in notify_error_count_thresholds
-                or error_count % error_count_max_notify_threshold == 0
-            ):
-                try:
-                    await messages.send_message(
-                        f"🔥 *ERROR*: The check has been failing for `{error_count}` times in a row! Cause: {repr(e)}",
-                        scape=True
-                    )
-                except Exception as e2:
-                    log.error(traceback.format_exc())
-                    log.error("Nested error. Error sending the Error message")
+async def wait_next_check(check_finished, validator_monitor):
+    # Wait for the polling interval (longer while there are hot validators). Re-time the wait if the config is reloaded
+    while not exit_event.is_set():
+        polling_wait, _ = validator_monitor.get_polling_waits(
+            settings["polling_wait"], settings["hot_polling_wait"]
+        )
+        remaining = check_finished + polling_wait - time.monotonic()
+        if remaining <= 0:
+            return
+
+        config_reloaded_event.clear()
+        config_reloaded_task = asyncio.create_task(config_reloaded_event.wait())
+        try:
+            await wait_or_exit(config_reloaded_task, timeout=remaining)
         finally:
-            prometheus.main_loop_consecutive_errors_gauge.set(error_count)
-            log.debug(f"Next check in {polling_wait} seconds")
-            exit_event.wait(polling_wait)
+            config_reloaded_task.cancel()
+
+
+async def watch_config(validator_monitor, validator_effectiveness, validator_duties):
+    # Reload the config when the file changes
+    while not exit_event.is_set():
+        await wait_or_exit(timeout=CONFIG_RELOAD_SECONDS)
+        if exit_event.is_set():
+            break
+
+        previous_config, previous_mtime = utils.config_cache, utils.config_mtime
+        try:
+            config = utils.reload_config()
+            if config is None:
+                continue
+            await apply_config(
+                config, validator_monitor, validator_effectiveness, validator_duties
+            )
+        except Exception:
+            log.error(traceback.format_exc())
+            log.error(
+                "Error reloading the config. Keeping the previous one, and trying again"
+            )
+
+            # Read the file again in the next reload
+            utils.config_cache, utils.config_mtime = previous_config, previous_mtime
+            validators.reset_config()
+
+
+async def apply_config(
+    config, validator_monitor, validator_effectiveness, validator_duties
+):
+    global settings
+    log.info("Config file changed. Reloading it")
+
+    # Resolve the validators first, so the previous config is kept if it fails (the public keys that fail are skipped,
+    # and retried in the background)
+    new_settings = get_settings(config)
+    validators.reset_config()
+    monitored_validators = await validators.backfill_validators(
+        new_settings["backfill_concurrency"], new_settings["batch_request_delay"]
+    )
+
+    # Update the settings
+    alerts.setup(config.get("alerts", None))
+    monitors = get_monitors(
+        validator_monitor, validator_effectiveness, validator_duties
+    )
+    if validator_duties is not None:
+        validator_duties.set_sync_participation_threshold(
+            new_settings["sync_participation_threshold"]
+        )
+    for monitor in monitors:
+        monitor.update_settings(
+            batch_request_delay=new_settings["batch_request_delay"],
+            notify_delay_seconds=new_settings["notify_delay_seconds"],
+        )
+    validator_effectiveness.set_effectiveness_threshold(
+        new_settings["notify_effectiveness_threshold"]
+    )
+    for monitor in (validator_monitor, validator_effectiveness):
+        monitor.set_stale_cycles(new_settings["notify_stale_cycles"])
+    validator_monitor.lifecycle.update_settings(
+        terminal_polling_cycles=new_settings["terminal_polling_cycles"],
+        pending_polling_cycles=new_settings["pending_polling_cycles"],
+    )
+    validator_monitor.update_hot_settings(
+        hot_window_seconds=new_settings["hot_window_seconds"],
+        hot_max_validators=get_hot_max_validators(new_settings),
+    )
+    settings = new_settings
+
+    # Update the monitored validators (only the new public keys were resolved)
+    added_validators, removed_validators = set_monitored_validators(
+        monitored_validators, monitors
+    )
+    log.info(
+        f"Config reloaded. Monitoring {len(monitored_validators)} validators ({len(added_validators)} added, {len(removed_validators)} removed)"
+    )
+    if added_validators or removed_validators:
+        await alerts.notify(
+            alerts.MONITORING,
+            f"Config reloaded\\. Will keep an 👀 on `{len(monitored_validators)}` validators",
+        )
+
+    if validators.failed_public_keys:
+        start_backfill_retry(monitors)
+
+    # Re-time the next check
+    config_reloaded_event.set()
+
+
+async def wait_or_exit(task=None, timeout=None):
+    """
+    Waits for the task to finish (or for the timeout), and returns early if the app is shutting down
+    """
+    exit_task = asyncio.create_task(exit_event.wait())
+    aws = {exit_task} if task is None else {exit_task, task}
+    try:
+        await asyncio.wait(aws, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        exit_task.cancel()
+
+
+async def drain(task, timeout):
+    if task is None or task.done():
+        return
+
+    if timeout > 0:
+        await asyncio.wait({task}, timeout=timeout)
+
+    if not task.done():
+        log.debug("Cancelling task %s", task.get_coro().__name__)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
 
 
 async def say_goodbye():
     log.info("Have a good day Ser!")
-    await messages.send_message(
-        f"💤 Validator Monitor *SHUTDOWN*. Have a nice day Ser!",
-        scape=True
+    await alerts.notify(
+        alerts.SHUTDOWN,
+        messages.scape_markdown(f"💤 Validator Monitor *SHUTDOWN*. Have a nice day Ser!"),
     )
 
+    # Send the pending digests before leaving
+    await alerts.flush_digests()
+
+
 def exit_with_code(code):
     global exit_code
     exit_code = code
     exit_event.set()
 
 
-def stop(signal_number=None, _stack=None):
+def stop(signal_number=None):
     log.info("Shutting down (Signal=%s)", signal_number)
     exit_event.set()
 
 
-if __name__ == "__main__":
-    for sig in ("TERM", "HUP", "INT"):
-        signal.signal(getattr(signal, "SIG" + sig), stop)
+async def run():
+    global exit_event, config_reloaded_event
+    exit_event = asyncio.Event()
+    config_reloaded_event = asyncio.Event()
+
+    # Handle the signals in the event loop, so the shutdown doesn't wait for the polling interval
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGHUP, signal.SIGINT):
+        loop.add_signal_handler(sig, stop, sig.name)
+
+    # Profile on demand (kill -USR1 <pid>)
+    loop.add_signal_handler(signal.SIGUSR1, tracing.start_profiler)
 
     try:
-        asyncio.run(main())
-    except KeyboardInterrupt:  # pragma: no branch
-        pass
+        await main()
     finally:
-        asyncio.run(say_goodbye())
+        try:
+            await asyncio.wait_for(say_goodbye(), timeout=GOODBYE_TIMEOUT_SECONDS)
+        except Exception:
+            log.error(traceback.format_exc())
+            log.error("Error sending the goodbye message")
+        capture.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
     if exit_code != 0:
         sys.exit(exit_code)
-
@@ -0,0 +1,175 @@
+from array import array
+import itertools
+import time
+import util.prometheus as prometheus
+import util.utils as utils
+
+log = utils.getLog(__name__)
+
+# Checks without observing a validator to consider its data stale (when the stale alert is disabled)
+DEFAULT_STALE_CYCLES = 3
+
+
+class CoverageTracker:
+    """
+    Keeps track of the last time every validator was observed by a check, to report the coverage of the check (ratio of
+    the requested validators that were observed) and the validators with stale data (not observed in the last
+    "stale_cycles" checks where they were expected, i.e. because their batch failed).
+
+    Validators polled out of the check (i.e. the hot validators) are expected in the cycle too: their observations keep
+    their data fresh, and failing to observe them makes them stale. But they don't count for the coverage of the check,
+    nor for the age of the observations (they are polled more often).
+
+    The data is kept in arrays indexed by the position of the validator in the monitored validators, so every
+    observation is O(1)
+    """
+
+    def __init__(self, check_name, monitored_validators, stale_cycles=None):
+        self.check_name = check_name
+        self.stale_cycles = stale_cycles
+        self.cycle = 0
+        self.observed_in_cycle = 0
+        self.stale_count = 0
+        self.validators_requested = []
+        self.validators_expected = set()
+        self.positions = {}
+        self.last_observed = array("d")
+        self.last_observed_cycle = array("L")
+        self.requested_cycle = array("L")
+        self.expected_cycle = array("L")
+        self.missed_cycles = array("L")
+        self.monitored_since = array("d")
+        self.observation_age_histogram = prometheus.observation_age_histogram.labels(
+            check=check_name
+        )
+        self.set_monitored_validators(monitored_validators)
+
+    def get_stale_threshold(self):
+        return self.stale_cycles if self.stale_cycles is not None else DEFAULT_STALE_CYCLES
+
+    def set_stale_cycles(self, stale_cycles):
+        self.stale_cycles = stale_cycles
+        self.__count_stale()
+
+    def set_monitored_validators(self, monitored_validators):
+        # Keep the observations of the validators that are still monitored
+        validators_total = len(monitored_validators)
+        positions = {}
+        last_observed = array("d", [0.0]) * validators_total
+        last_observed_cycle = array("L", [0]) * validators_total
+        requested_cycle = array("L", [0]) * validators_total
+        expected_cycle = array("L", [0]) * validators_total
+        missed_cycles = array("L", [0]) * validators_total
+        monitored_since = array("d", [time.monotonic()]) * validators_total
+        for position, index in enumerate(monitored_validators):
+            positions[index] = position
+            previous_position = self.positions.get(index, None)
+            if previous_position is not None:
+                last_observed[position] = self.last_observed[previous_position]
+                last_observed_cycle[position] = self.last_observed_cycle[previous_position]
+                requested_cycle[position] = self.requested_cycle[previous_position]
+                expected_cycle[position] = self.expected_cycle[previous_position]
+                missed_cycles[position] = self.missed_cycles[previous_position]
+                monitored_since[position] = self.monitored_since[previous_position]
+
+        self.positions = positions
+        self.last_observed = last_observed
+        self.last_observed_cycle = last_observed_cycle
+        self.requested_cycle = requested_cycle
+        self.expected_cycle = expected_cycle
+        self.missed_cycles = missed_cycles
+        self.monitored_since = monitored_since
+        self.__count_stale()
+
+    def start_cycle(self, validators_requested):
+        """
+        Starts a check of the validators requested. Only their observations count for the coverage of the check
+        """
+        self.cycle += 1
+        self.observed_in_cycle = 0
+        self.validators_requested = validators_requested
+        self.validators_expected = set()
+        for index in validators_requested:
+            position = self.positions.get(index, None)
+            if position is not None:
+                self.requested_cycle[position] = self.cycle
+                self.expected_cycle[position] = self.cycle
+
+    def expect(self, validators_polled):
+        """
+        Registers the validators polled out of the check (i.e. the hot validators), so they become stale if they are
+        not observed
+        """
+        for index in validators_polled:
+            position = self.positions.get(index, None)
+            if position is not None and self.expected_cycle[position] != self.cycle:
+                self.expected_cycle[position] = self.cycle
+                self.validators_expected.add(index)
+
+    def observe(self, index):
+        position = self.positions.get(index, None)
+        if position is None:
+            return
+
+        now = time.monotonic()
+        requested = self.requested_cycle[position] == self.cycle
+        if requested and self.last_observed[position] > 0:
+            self.observation_age_histogram.observe(now - self.last_observed[position])
+        self.last_observed[position] = now
+
+        if self.last_observed_cycle[position] != self.cycle:
+            self.last_observed_cycle[position] = self.cycle
+            if requested:
+                self.observed_in_cycle += 1
+        if self.missed_cycles[position] >= self.get_stale_threshold():
+            self.stale_count -= 1
+        self.missed_cycles[position] = 0
+
+    def end_cycle(self):
+        """
+        Reports the coverage of the check, and the age of the oldest observation of the validators missed in the check.
+        Returns the validators that just became stale
+        """
+        validators_requested = self.validators_requested
+        stale_threshold = self.get_stale_threshold()
+        validators_stale = []
+        oldest_observation = now = time.monotonic()
+        for index in itertools.chain(validators_requested, self.validators_expected):
+            position = self.positions.get(index, None)
+            if position is None or self.last_observed_cycle[position] == self.cycle:
+                continue
+
+            # The histogram only has the validators observed again, so report the oldest observation of the missed ones
+            oldest_observation = min(
+                oldest_observation,
+                max(self.last_observed[position], self.monitored_since[position]),
+            )
+            self.missed_cycles[position] += 1
+            if self.missed_cycles[position] == stale_threshold:
+                self.stale_count += 1
+                validators_stale.append(index)
+
+        coverage = (
+            self.observed_in_cycle / len(validators_requested)
+            if validators_requested
+            else 1
+        )
+        prometheus.coverage_gauge.labels(check=self.check_name).set(coverage)
+        prometheus.stale_validators_gauge.labels(check=self.check_name).set(
+            self.stale_count
+        )
+        prometheus.oldest_observation_age_gauge.labels(check=self.check_name).set(
+            now - oldest_observation
+        )
+        if coverage < 1:
+            log.warning(
+                f"The {self.check_name} check observed {self.observed_in_cycle} of {len(validators_requested)} validators ({coverage:.1%} coverage, {self.stale_count} validators with stale data)"
+            )
+
+        return validators_stale
+
+    def __count_stale(self):
+        stale_threshold = self.get_stale_threshold()
+        self.stale_count = sum(
+            1 for missed_cycles in self.missed_cycles if missed_cycles >= stale_threshold
+        )
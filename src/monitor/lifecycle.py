@@ -0,0 +1,173 @@
+import util.validators as validators
+import util.utils as utils
+
+log = utils.getLog(__name__)
+
+PENDING = "pending"
+ACTIVE = "active"
+EXITING = "exiting"
+EXITED = "exited"
+SLASHED = "slashed"
+
+TERMINAL_STATES = (EXITED, SLASHED)
+
+# Activation epoch of the validators that are not in the activation queue yet
+FAR_FUTURE_EPOCH = 2**64 - 1
+
+# Status reported by the Beacon Chain API (i.e. active_online, exiting_offline, slashing_online, ...)
+STATUS_PREFIXES = [
+    ("deposited", PENDING),
+    ("pending", PENDING),
+    ("active", ACTIVE),
+    ("exiting", EXITING),
+    ("slashing", EXITING),
+    ("slashed", SLASHED),
+    ("exited", EXITED),
+    ("withdrawn", EXITED),
+    ("withdrawal", EXITED),
+]
+
+
+def get_lifecycle_state(status):
+    for prefix, state in STATUS_PREFIXES:
+        if status.startswith(prefix):
+            return state
+
+    # Unknown status. Keep polling it as an active validator
+    return ACTIVE
+
+
+class ValidatorLifecycle:
+    """
+    Keeps track of the lifecycle of the validators (pending, active, exiting, exited and slashed), and decides which
+    ones need to be polled in every cycle:
+        - Active and exiting validators (and the ones we don't know yet) are polled in every cycle
+        - Exited and slashed validators are polled every "terminal_polling_cycles" cycles
+        - Pending validators are polled every "pending_polling_cycles" cycles, and in every cycle when they are close
+          to their activation epoch
+        - Validators waiting to notify a change are polled in every cycle
+    """
+
+    def __init__(
+        self,
+        terminal_polling_cycles,
+        pending_polling_cycles,
+        activation_margin_epochs=2,
+    ):
+        self.terminal_polling_cycles = terminal_polling_cycles
+        self.pending_polling_cycles = pending_polling_cycles
+        self.activation_margin_epochs = activation_margin_epochs
+        self.cycle = 0
+        self.states = {}
+        self.activation_epochs = {}
+        self.current_epoch = None
+
+    def update_settings(self, terminal_polling_cycles, pending_polling_cycles):
+        self.terminal_polling_cycles = terminal_polling_cycles
+        self.pending_polling_cycles = pending_polling_cycles
+
+    def next_cycle(self):
+        self.cycle += 1
+
+    def is_polling_cycle(self, polling_cycles):
+        # Values <= 0 poll in every cycle
+        return polling_cycles <= 0 or self.cycle % polling_cycles == 0
+
+    def update(self, index, status):
+        """
+        Updates the lifecycle state of the validator using its status. Returns the new state
+        """
+        state = get_lifecycle_state(status)
+        previous_state = self.states.get(index, None)
+        if state != previous_state:
+            if previous_state is not None:
+                log.info(f"Validator {index} lifecycle changed: {previous_state} -> {state}")
+            self.states[index] = state
+            if state != PENDING:
+                self.activation_epochs.pop(index, None)
+        return state
+
+    def forget(self, index):
+        self.states.pop(index, None)
+        self.activation_epochs.pop(index, None)
+
+    def is_pending(self, index):
+        return self.states.get(index, None) == PENDING
+
+    def is_attesting(self, index):
+        # Only active and exiting validators have attestation duties
+        return self.states.get(index, ACTIVE) in (ACTIVE, EXITING)
+
+    def should_poll(self, index):
+        state = self.states.get(index, None)
+        if state in TERMINAL_STATES:
+            return self.is_polling_cycle(self.terminal_polling_cycles)
+
+        if state == PENDING:
+            return (
+                self.is_polling_cycle(self.pending_polling_cycles)
+                or self.__is_close_to_activation(index)
+            )
+
+        return True
+
+    def get_validators_to_poll(
+        self, monitored_validators, validators_waiting_to_notify=()
+    ):
+        # The validators waiting to notify a change are polled in every cycle, so the change is notified in time (i.e.
+        # a validator that just exited)
+        return [
+            index
+            for index in monitored_validators
+            if index in validators_waiting_to_notify or self.should_poll(index)
+        ]
+
+    def get_validators_attesting(self, monitored_validators):
+        return [index for index in monitored_validators if self.is_attesting(index)]
+
+    def get_validators_count(self):
+        validators_count = {}
+        for state in self.states.values():
+            validators_count[state] = validators_count.get(state, 0) + 1
+        return validators_count
+
+    def __is_close_to_activation(self, index):
+        activation_epoch = self.activation_epochs.get(index, None)
+        if (
+            activation_epoch is None
+            or activation_epoch == FAR_FUTURE_EPOCH
+            or self.current_epoch is None
+        ):
+            return False
+        return self.current_epoch >= activation_epoch - self.activation_margin_epochs
+
+    async def update_activation_epochs(self):
+        """
+        Gets the activation epoch of the pending validators, and the current epoch. Done only in the cycles where the
+        pending validators are polled. The activation epoch is assigned when the validator enters the activation queue,
+        so it's requested again until the validator is close to its activation
+        """
+        if not self.is_polling_cycle(self.pending_polling_cycles):
+            return
+
+        pending_validators = [
+            index for index, state in self.states.items() if state == PENDING
+        ]
+        if not pending_validators:
+            return
+
+        self.current_epoch = await utils.run_in_thread(validators.get_current_epoch)
+        validators_without_epoch = [
+            index
+            for index in pending_validators
+            if not self.__is_close_to_activation(index)
+        ]
+        if validators_without_epoch:
+            activation_epochs = await utils.run_in_thread(
+                validators.get_validators_activation_epoch, validators_without_epoch
+            )
+            self.activation_epochs.update(activation_epochs)
+
+        log.info(
+            f"{len(pending_validators)} validators pending activation (current epoch: {self.current_epoch})"
+        )
@@ -1,7 +1,11 @@
 import datetime
+import heapq
+import time
 import util.validators as validators
 import util.messages as messages
+import util.alerts as alerts
 import util.prometheus as prometheus
+import util.tracing as tracing
 import util.utils as utils
 
 log = utils.getLog(__name__)
@@ -23,66 +27,139 @@ class Monitor:
         self.notify_delay_seconds = notify_delay_seconds
         self.validators_waiting_to_notify = {}
 
-    def update_validators_waiting_to_notify(self, validator_change_state_indexes):
-        #   Get validators that are waiting to do some notification
-        validators_waiting_to_notify_indexes = self.validators_waiting_to_notify.keys()
+        # Min-heap of pending notifications: (deadline, index, waiting since)
+        self.notify_deadlines = []
 
-        #   Get validators that were waiting to notify but went back to normal
-        validators_went_back_to_normal_indexes = set(
-            validators_waiting_to_notify_indexes
-        ) - set(validator_change_state_indexes)
+        # Timings of the last check (exposed by the query API)
+        self.last_check_at = None
+        self.last_check_seconds = None
 
-        # Remove validators that went back to normal from waiting list
-        if validators_went_back_to_normal_indexes:
+        # Last observation of every validator (only for the monitors polling all the validators)
+        self.coverage = None
+
+    def update_settings(self, batch_request_delay, notify_delay_seconds):
+        # The new notify delay applies to the changes detected from now on
+        self.batch_request_delay = batch_request_delay
+        self.notify_delay_seconds = notify_delay_seconds
+
+    def set_monitored_validators(self, monitored_validators):
+        # Replace the list (a check in progress keeps using the previous one)
+        removed_validators = set(self.monitored_validators) - set(monitored_validators)
+        self.monitored_validators = monitored_validators
+        for index in removed_validators:
+            self.forget_validator(index)
+        if self.coverage is not None:
+            self.coverage.set_monitored_validators(monitored_validators)
+
+    def forget_validator(self, index):
+        # Stop waiting to notify removed validators (its entry in the heap is discarded when popped)
+        self.validators_waiting_to_notify.pop(index, None)
+
+    def set_stale_cycles(self, stale_cycles):
+        if self.coverage is not None:
+            self.coverage.set_stale_cycles(stale_cycles)
+
+    async def report_coverage(self):
+        """
+        Reports the coverage of the check, and notifies the validators that became stale (if enabled)
+        """
+        validators_stale = self.coverage.end_cycle()
+        if validators_stale and self.coverage.stale_cycles is not None:
+            message_base = f"{len(validators_stale)} Validators have no {self.coverage.check_name} data for {self.coverage.stale_cycles} checks ⌛: "
+            await messages.send_message_validators(
+                message_base, validators_stale, True, alerts.STALE
+            )
+
+    def record_check_time(self, started):
+        self.last_check_at = datetime.datetime.now()
+        self.last_check_seconds = time.monotonic() - started
+
+    def update_validator_waiting_to_notify(self, index, changed):
+        """
+        Registers the validator as waiting to notify its change (if it changed). Returns True if the validator was
+        waiting to notify, but it went back to normal
+        """
+        if changed:
+            if index not in self.validators_waiting_to_notify:
+                # Register time, and schedule the notification after the notify delay
+                now = datetime.datetime.now()
+                deadline = now + datetime.timedelta(seconds=self.notify_delay_seconds)
+                self.validators_waiting_to_notify[index] = now
+                heapq.heappush(self.notify_deadlines, (deadline, index, now))
+            return False
+
+        if index in self.validators_waiting_to_notify:
+            # Went back to normal. Its entry in the heap is discarded when it's popped
+            del self.validators_waiting_to_notify[index]
+            self.__compact_notify_deadlines()
+            return True
+
+        return False
+
+    def log_recovered_validators(self, validators_recovered_indexes):
+        if validators_recovered_indexes:
             validators_str = ", ".join(
-                [str(index) for index in validators_went_back_to_normal_indexes]
+                [str(index) for index in validators_recovered_indexes]
             )
             log.info(
-                f"💖 {len(validators_went_back_to_normal_indexes)} validators recovered. No need to notify anymore: {validators_str}"
+                f"💖 {len(validators_recovered_indexes)} validators recovered. No need to notify anymore: {validators_str}"
             )
-            for index in validators_went_back_to_normal_indexes:
-                del self.validators_waiting_to_notify[index]
-
-        if not validator_change_state_indexes:
-            # No waiting for any notification
-            max_waiting_to_notify = None
-        else:
-            # Waiting to do some notifications
-            now = datetime.datetime.now()
-            max_waiting_to_notify = now
-            # Update the waiting time for validators that were not waiting before
-            for index in validator_change_state_indexes:
-                # Register time (if not registered already)
-                waiting_to_notify = self.validators_waiting_to_notify.get(index, now)
-                self.validators_waiting_to_notify[index] = waiting_to_notify
-
-                # Calculate the validator waiting for longer
-                if max_waiting_to_notify > waiting_to_notify:
-                    max_waiting_to_notify = waiting_to_notify
-
-        return max_waiting_to_notify
-
-    def should_notify_change_state(self, max_waiting_to_notify):
-        # Decide if we should notify right away, or wait a few seconds
-        notify = False
-        reset_delay_counter = False
-
-        if max_waiting_to_notify:
-            # We are waiting to notify some status changes
-            waiting_time = datetime.datetime.now() - max_waiting_to_notify
-            remaining_time = self.notify_delay_seconds - waiting_time.total_seconds()
-            if remaining_time >= 0:
-                # We haven't waited enough, wait more!
-                log.info(
-                    f"⏱ Waiting {remaining_time:.0f}s more before notifying validator changes. Waited for {waiting_time.total_seconds():.0f}s to notify some validators changes"
-                )
-            else:
-                # We waited enough! Notify and reset the delay
-                log.info(f"✉️ Waited enough! The validator changes will be notified")
-                notify = True
-                reset_delay_counter = True
-        else:
-            # Reset the delay counters if theres no changes
-            reset_delay_counter = True
-
-        return notify, reset_delay_counter
+
+    @tracing.traced("pop_validators_to_notify")
+    def pop_validators_to_notify(self, validators_changed):
+        """
+        Returns the validators that waited enough to be notified, and removes them from the waiting list. Validators
+        that were not checked in this cycle (not in validators_changed) keep waiting until they are checked again
+        """
+        now = datetime.datetime.now()
+        validators_to_notify = set()
+        validators_not_checked = []
+        while self.notify_deadlines:
+            deadline, index, waiting_since = self.notify_deadlines[0]
+            if not self.__is_waiting_to_notify(index, waiting_since):
+                # Stale entry (the validator recovered, or was already notified)
+                heapq.heappop(self.notify_deadlines)
+                continue
+
+            if deadline > now:
+                break
+
+            entry = heapq.heappop(self.notify_deadlines)
+            if index not in validators_changed:
+                validators_not_checked.append(entry)
+                continue
+
+            del self.validators_waiting_to_notify[index]
+            validators_to_notify.add(index)
+
+        for entry in validators_not_checked:
+            heapq.heappush(self.notify_deadlines, entry)
+
+        if validators_to_notify:
+            log.info(
+                f"✉️ Waited enough! The changes of {len(validators_to_notify)} validators will be notified"
+            )
+
+        if self.notify_deadlines:
+            # Log the waiting time of the next notification
+            deadline, _, waiting_since = self.notify_deadlines[0]
+            remaining_time = (deadline - now).total_seconds()
+            waiting_time = (now - waiting_since).total_seconds()
+            log.info(
+                f"⏱ Waiting {remaining_time:.0f}s more before notifying validator changes. Waited for {waiting_time:.0f}s to notify some validators changes ({len(self.validators_waiting_to_notify)} validators waiting)"
+            )
+
+        return validators_to_notify
+
+    def __is_waiting_to_notify(self, index, waiting_since):
+        return self.validators_waiting_to_notify.get(index, None) == waiting_since
+
+    def __compact_notify_deadlines(self):
+        # Rebuild the heap when most of its entries are stale
+        if len(self.notify_deadlines) > 2 * len(self.validators_waiting_to_notify) + 64:
+            self.notify_deadlines = [
+                entry
+                for entry in self.notify_deadlines
+                if self.__is_waiting_to_notify(entry[1], entry[2])
+            ]
+            heapq.heapify(self.notify_deadlines)
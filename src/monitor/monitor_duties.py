@@ -0,0 +1,279 @@
+import time
+import traceback
+import util.validators as validators
+import util.messages as messages
+import util.alerts as alerts
+import util.prometheus as prometheus
+import util.tracing as tracing
+import util.utils as utils
+from .monitor import Monitor
+
+log = utils.getLog(__name__)
+
+PROPOSAL_MISSED_LABEL = "*MISSED* a block proposal 🧱"
+SYNC_LABEL_OK = "*OK* 🔄"
+SYNC_LABEL_KO = "*Low* 🚨"
+
+# Status of the slots in the Beacon Chain API
+SLOT_PROPOSED = "1"
+SLOT_MISSED_STATUS = ["2", "3"]  # Missed, Orphaned
+
+# Max number of completed epochs checked at once (i.e. after the API was down for a while)
+MAX_EPOCHS_BEHIND = 16
+
+
+class MonitorDuties(Monitor):
+    """
+    Monitors the block proposals and the sync committee participation of a set of validators.
+
+    The duties are fetched once per epoch (proposers) and once per sync committee period, and indexed by slot (or
+    sync committee position) for the monitored validators. When an epoch is over, only the slots where the validators
+    had duties are checked. All the epochs completed since the last check are checked (the epochs can be shorter than
+    the polling interval).
+    """
+
+    def __init__(
+        self,
+        monitored_validators,
+        batch_request_delay,
+        notify_delay_seconds,
+        sync_participation_threshold,
+    ):
+        Monitor.__init__(
+            self,
+            monitored_validators=monitored_validators,
+            batch_request_delay=batch_request_delay,
+            notify_delay_seconds=notify_delay_seconds,
+        )
+        self.sync_participation_threshold = sync_participation_threshold
+        self.current_epoch = None
+
+        # Last epoch with all its duties checked, and last epoch with its proposals checked (they are notified only once,
+        # even if the check of the sync committee fails and the epoch is checked again)
+        self.checked_epoch = None
+        self.proposals_checked_epoch = None
+
+        # Proposer duties of the monitored validators: epoch -> {slot: index}
+        self.proposer_duties = {}
+
+        # Sync committee positions of the monitored validators: index -> [positions]
+        self.sync_committee = {}
+        self.sync_committee_end_epoch = None
+        self.validators_sync_ok = {}
+
+    def set_sync_participation_threshold(self, sync_participation_threshold):
+        self.sync_participation_threshold = sync_participation_threshold
+
+    def set_monitored_validators(self, monitored_validators):
+        validators_changed = set(monitored_validators) != set(self.monitored_validators)
+        super().set_monitored_validators(monitored_validators)
+        if not validators_changed:
+            return
+
+        # Keep the known duties of the validators still monitored (the new ones are indexed in the next epoch), and
+        # refresh the sync committee in the next epoch
+        monitored_validators = set(monitored_validators)
+        self.proposer_duties = {
+            epoch: {
+                slot: index
+                for slot, index in duties.items()
+                if index in monitored_validators
+            }
+            for epoch, duties in self.proposer_duties.items()
+        }
+        self.sync_committee_end_epoch = None
+
+    def forget_validator(self, index):
+        super().forget_validator(index)
+        self.sync_committee.pop(index, None)
+        self.validators_sync_ok.pop(index, None)
+
+    async def check(self):
+        log.debug("Check Duties of Validators")
+        started = time.monotonic()
+
+        # A failure of the duties doesn't fail the whole check
+        try:
+            await self.__check_epoch(started)
+        except Exception:
+            log.error(traceback.format_exc())
+            log.error("Error checking the duties of the validators")
+
+    async def __check_epoch(self, started):
+        current_epoch = await utils.run_in_thread(validators.get_current_epoch)
+        if current_epoch == self.current_epoch:
+            # Nothing to do until the epoch is over
+            return
+
+        # Index the proposals of the new epoch
+        if current_epoch not in self.proposer_duties:
+            await self.__update_proposer_duties(current_epoch)
+
+        # Check the duties of the epochs completed since the last check (if it fails, they are checked again in the
+        # next check)
+        if self.checked_epoch is None:
+            self.checked_epoch = current_epoch - 1
+        if current_epoch - self.checked_epoch - 1 > MAX_EPOCHS_BEHIND:
+            log.warning(
+                f"Skipping the duties of the epochs {self.checked_epoch + 1} to {current_epoch - MAX_EPOCHS_BEHIND - 1}. Too many epochs since the last check"
+            )
+            self.checked_epoch = current_epoch - MAX_EPOCHS_BEHIND - 1
+
+        for completed_epoch in range(self.checked_epoch + 1, current_epoch):
+            if (
+                self.proposals_checked_epoch is None
+                or completed_epoch > self.proposals_checked_epoch
+            ):
+                await self.__check_proposals(completed_epoch)
+                self.proposals_checked_epoch = completed_epoch
+
+            # The sync committee of the epoch (the epoch is checked before moving to the next period)
+            await self.__update_sync_committee(completed_epoch)
+            await self.__check_sync_committee(completed_epoch)
+            self.checked_epoch = completed_epoch
+
+        # Index the sync committee of the new epoch
+        await self.__update_sync_committee(current_epoch)
+        self.current_epoch = current_epoch
+
+        # Keep only the duties of the epochs not checked yet
+        self.proposer_duties = {
+            epoch: duties
+            for epoch, duties in self.proposer_duties.items()
+            if epoch > self.checked_epoch
+        }
+
+        self.record_check_time(started)
+
+    async def __update_proposer_duties(self, epoch):
+        monitored_validators = set(self.monitored_validators)
+        proposers = await utils.run_in_thread(validators.get_epoch_proposers, epoch)
+        self.proposer_duties[epoch] = {
+            slot: index
+            for slot, index in proposers.items()
+            if index in monitored_validators
+        }
+
+        if self.proposer_duties[epoch]:
+            log.info(
+                f"Epoch {epoch}: {len(self.proposer_duties[epoch])} block proposals for the monitored validators"
+            )
+
+    async def __update_sync_committee(self, epoch):
+        if (
+            self.sync_committee_end_epoch is not None
+            and epoch <= self.sync_committee_end_epoch
+        ):
+            # Same sync committee period
+            return
+
+        sync_committee = await utils.run_in_thread(validators.get_sync_committee)
+        monitored_validators = set(self.monitored_validators)
+        self.sync_committee = {}
+        for position, index in enumerate(sync_committee["validators"]):
+            if index in monitored_validators:
+                self.sync_committee.setdefault(index, []).append(position)
+        self.sync_committee_end_epoch = sync_committee["end_epoch"]
+
+        if self.sync_committee:
+            log.info(
+                f"{len(self.sync_committee)} monitored validators are in the sync committee until epoch {self.sync_committee_end_epoch}"
+            )
+
+    @tracing.traced("check_proposals")
+    async def __check_proposals(self, epoch):
+        if epoch not in self.proposer_duties:
+            # The epoch started and ended between two checks
+            await self.__update_proposer_duties(epoch)
+        duties = self.proposer_duties[epoch]
+
+        validators_missed = []
+        for slot, index in duties.items():
+            status = await utils.run_in_thread(validators.get_slot_status, slot)
+            if status in SLOT_MISSED_STATUS:
+                validators_missed.append(index)
+                prometheus.validator_missed_proposals_counter.labels(index=index).inc()
+            elif status == SLOT_PROPOSED:
+                prometheus.validator_proposals_counter.labels(index=index).inc()
+
+        # Missed proposals are events (there's no state to go back to), so they are notified right away
+        if validators_missed:
+            message_base = (
+                f"{len(validators_missed)} Validators {PROPOSAL_MISSED_LABEL}: "
+            )
+            await messages.send_message_validators(
+                message_base, validators_missed, True, alerts.PROPOSAL_MISSED
+            )
+
+    @tracing.traced("check_sync_committee")
+    async def __check_sync_committee(self, epoch):
+        if not self.sync_committee:
+            return
+
+        # Participation of the validators in the sync aggregates of the epoch (only when in the sync committee)
+        slots = await utils.run_in_thread(validators.get_epoch_slots, epoch)
+        participations = {index: [0, 0] for index in self.sync_committee}
+        for slot in slots:
+            if slot["status"] != SLOT_PROPOSED or not slot.get("syncaggregate_bits"):
+                continue
+
+            sync_bits = bytes.fromhex(slot["syncaggregate_bits"][2:])
+            for index, positions in self.sync_committee.items():
+                for position in positions:
+                    participations[index][1] += 1
+                    if sync_bits[position // 8] >> (position % 8) & 1:
+                        participations[index][0] += 1
+
+        # Detect changes, and feed them to the notification waiting list
+        validators_change_to_ok = []
+        validators_change_to_ko = []
+        validators_recovered = []
+        for index, (participated, expected) in participations.items():
+            if expected == 0:
+                continue
+
+            participation = participated / expected
+            prometheus.validator_sync_participation_gauge.labels(index=index).set(
+                participation
+            )
+            sync_ok = participation >= self.sync_participation_threshold
+            changed = sync_ok != self.validators_sync_ok.get(index, True)
+            if super().update_validator_waiting_to_notify(index, changed):
+                validators_recovered.append(index)
+
+            if changed:
+                (validators_change_to_ok if sync_ok else validators_change_to_ko).append(
+                    index
+                )
+
+        super().log_recovered_validators(validators_recovered)
+        validators_to_notify = super().pop_validators_to_notify(
+            set(validators_change_to_ok + validators_change_to_ko)
+        )
+
+        for validators_change, sync_ok, label, event in (
+            (validators_change_to_ok, True, SYNC_LABEL_OK, alerts.SYNC_OK),
+            (validators_change_to_ko, False, SYNC_LABEL_KO, alerts.SYNC_LOW),
+        ):
+            validators_notify = [
+                index for index in validators_change if index in validators_to_notify
+            ]
+            validators_wait = [
+                index
+                for index in validators_change
+                if index not in validators_to_notify
+            ]
+
+            # Update the sync committee status (only when notifying)
+            for index in validators_notify:
+                self.validators_sync_ok[index] = sync_ok
+
+            for validators_group, notify in (
+                (validators_notify, True),
+                (validators_wait, False),
+            ):
+                if validators_group:
+                    message_base = f"{len(validators_group)} Validators sync committee participation changed to {label}: "
+                    await messages.send_message_validators(
+                        message_base, validators_group, notify, event
+                    )
@@ -1,9 +1,14 @@
+import bisect
 import datetime
+import time
 import util.validators as validators
 import util.messages as messages
+import util.alerts as alerts
 import util.prometheus as prometheus
+import util.tracing as tracing
 import util.utils as utils
 from .monitor import Monitor
+from .coverage import CoverageTracker
 
 log = utils.getLog(__name__)
 
@@ -22,6 +27,8 @@ class MonitorEffectiveness(Monitor):
         batch_request_delay,
         notify_delay_seconds,
         notify_effectiveness_threshold,
+        lifecycle,
+        stale_cycles=None,
     ):
         Monitor.__init__(
             self,
@@ -31,20 +38,51 @@ class MonitorEffectiveness(Monitor):
         )
 
         self.notify_effectiveness_threshold = notify_effectiveness_threshold
+        self.lifecycle = lifecycle
+        self.coverage = CoverageTracker(
+            "effectiveness", monitored_validators, stale_cycles
+        )
         self.validators_effectiveness_ok = {}
         self.check_effectiveness_enabled = notify_effectiveness_threshold is not None
 
+        # Last observed effectiveness of every validator, and the same values sorted by effectiveness
+        self.validators_effectiveness = {}
+        self.validators_sorted_by_effectiveness = []
+
+    def set_effectiveness_threshold(self, notify_effectiveness_threshold):
+        self.notify_effectiveness_threshold = notify_effectiveness_threshold
+        self.check_effectiveness_enabled = notify_effectiveness_threshold is not None
+
+    def forget_validator(self, index):
+        validator = str(index)
+        super().forget_validator(validator)
+        self.validators_effectiveness_ok.pop(validator, None)
+        self.validators_effectiveness.pop(validator, None)
+        try:
+            prometheus.validator_effectiveness_gauge.remove(validator)
+        except KeyError:
+            pass
+
+    def get_validators_below_effectiveness(self, max_effectiveness):
+        # Sorted (effectiveness, index) pairs, so the lookup is a binary search
+        validators_sorted = self.validators_sorted_by_effectiveness
+        position = bisect.bisect_left(validators_sorted, (max_effectiveness,))
+        return [index for _, index in validators_sorted[:position]]
+
+    @tracing.traced("get_effectiveness_changes")
     def __get_effectiveness_changes(self, validators_effectiveness):
         validators_change_to_ok = []
         validators_change_to_ko = []
-        min_effectiveness = 1
+        validators_recovered = []
 
         for validator_effectiveness in validators_effectiveness:
+            self.coverage.observe(validator_effectiveness["index"])
             index = str(validator_effectiveness["index"])
             effectiveness = validator_effectiveness["effectiveness"]
             prometheus.validator_effectiveness_gauge.labels(index=index).set(
                 effectiveness
             )
+            self.validators_effectiveness[index] = effectiveness
 
             if self.check_effectiveness_enabled:
                 previous_effectiveness_ok = self.validators_effectiveness_ok.get(
@@ -55,7 +93,13 @@ class MonitorEffectiveness(Monitor):
                 #     f"Validator {index} has effectiveness of {effectiveness} (effectiveness_ok={effectiveness_ok}, previous_effectiveness_ok={previous_effectiveness_ok})"
                 # )
 
-                if effectiveness_ok == previous_effectiveness_ok:
+                changed = effectiveness_ok != previous_effectiveness_ok
+
+                # Update the notification waiting list
+                if super().update_validator_waiting_to_notify(index, changed):
+                    validators_recovered.append(index)
+
+                if not changed:
                     # No change in the effectiveness OK effectiveness
                     continue
 
@@ -66,17 +110,20 @@ class MonitorEffectiveness(Monitor):
                 )
                 validators_change.append(index)
 
-                # Keep track of the worst effectiveness
-                min_effectiveness = min(min_effectiveness, effectiveness)
-
-        return validators_change_to_ok, validators_change_to_ko, min_effectiveness
+        super().log_recovered_validators(validators_recovered)
+        return validators_change_to_ok, validators_change_to_ko
 
     async def check(self):
         log.debug("Check Effectiveness of Validators")
+        started = time.monotonic()
 
-        # Check if there are effectiveness changes
-        validators_effectiveness = validators.get_validators_effectiveness(
-            validators=self.monitored_validators,
+        # Check if there are effectiveness changes (only for validators with attestation duties)
+        validators_attesting = self.lifecycle.get_validators_attesting(
+            self.monitored_validators
+        )
+        self.coverage.start_cycle(validators_attesting)
+        validators_effectiveness = await validators.get_validators_effectiveness(
+            validators=validators_attesting,
             batch_request_delay=self.batch_request_delay,
         )
 
@@ -84,62 +131,74 @@ class MonitorEffectiveness(Monitor):
         (
             validators_change_to_ok,
             validators_change_to_ko,
-            min_effectiveness,
         ) = self.__get_effectiveness_changes(validators_effectiveness)
-
-        # Update the notification waiting list
-        validator_change_state_indexes = (
-            validators_change_to_ok + validators_change_to_ko
-        )
-        max_waiting_to_notify = super().update_validators_waiting_to_notify(
-            validator_change_state_indexes
+        self.validators_sorted_by_effectiveness = sorted(
+            (effectiveness, index)
+            for index, effectiveness in self.validators_effectiveness.items()
         )
 
-        notify, reset_delay_counter = super().should_notify_change_state(
-            max_waiting_to_notify
+        # Get the validators that waited enough since they changed
+        validators_to_notify = super().pop_validators_to_notify(
+            set(validators_change_to_ok + validators_change_to_ko)
         )
 
-        # Reset the notification delay counter
-        if reset_delay_counter or notify:
-            self.validators_waiting_to_notify = {}
-
         # Update state, and notify all the changes of state
         await self.__update_validator_state_and_notify(
-            validators_change_to_ok, validators_change_to_ko, notify, min_effectiveness
+            validators_change_to_ok, validators_change_to_ko, validators_to_notify
         )
+        self.record_check_time(started)
+        await self.report_coverage()
 
     async def __update_validator_state_and_notify(
         self,
         validators_change_to_ok,
         validators_change_to_ko,
-        notify,
-        min_effectiveness,
+        validators_to_notify,
     ):
-        if notify:
+        for validators_change, effectiveness_ok in (
+            (validators_change_to_ok, True),
+            (validators_change_to_ko, False),
+        ):
+            validators_notify = [
+                index for index in validators_change if index in validators_to_notify
+            ]
+            validators_wait = [
+                index
+                for index in validators_change
+                if index not in validators_to_notify
+            ]
+
             # Update the effectiveness from validators (only when notifying)
-            for index in validators_change_to_ok + validators_change_to_ko:
-                validator = str(index)
-                # Change the effectiveness status
-                previous_effectiveness_status = self.validators_effectiveness_ok.get(
-                    validator, True
-                )
-                self.validators_effectiveness_ok[
-                    validator
-                ] = not previous_effectiveness_status
-
-        if validators_change_to_ok:
-            message_base = f"{len(validators_change_to_ok)} Validators effectiveness changed to {EFFECTIVENESS_LABEL_OK}: "
-            await messages.send_message_validators(
-                message_base, validators_change_to_ok, notify
-            )
+            for index in validators_notify:
+                self.validators_effectiveness_ok[index] = effectiveness_ok
+
+            for validators_group, notify in (
+                (validators_notify, True),
+                (validators_wait, False),
+            ):
+                if validators_group:
+                    await self.__notify_effectiveness_change(
+                        validators_group, effectiveness_ok, notify
+                    )
 
-        if validators_change_to_ko:
-            message_base = f"{len(validators_change_to_ko)} Validators effectiveness changed to{EFFECTIVENESS_LABEL_KO} (~{min_effectiveness:.2}%): "
-            await messages.send_message_validators(
-                message_base, validators_change_to_ko, notify
+    async def __notify_effectiveness_change(
+        self, validators_group, effectiveness_ok, notify
+    ):
+        if effectiveness_ok:
+            message_base = f"{len(validators_group)} Validators effectiveness changed to {EFFECTIVENESS_LABEL_OK}: "
+        else:
+            # Report the worst effectiveness
+            min_effectiveness = min(
+                self.validators_effectiveness[index] for index in validators_group
             )
+            message_base = f"{len(validators_group)} Validators effectiveness changed to {EFFECTIVENESS_LABEL_KO} (~{min_effectiveness:.2}%): "
 
-        num_validators_change_to_ko = len(validators_change_to_ko)
+        await messages.send_message_validators(
+            message_base,
+            validators_group,
+            notify,
+            alerts.EFFECTIVENESS_OK if effectiveness_ok else alerts.EFFECTIVENESS_CRITICAL,
+        )
 
     # def __should_notify_change_state(
     #     self, validators_change_to_ok, validators_change_to_ko
@@ -1,14 +1,35 @@
 import datetime
+import math
+import time
+import traceback
 import util.validators as validators
 import util.messages as messages
+import util.alerts as alerts
 import util.prometheus as prometheus
+import util.tracing as tracing
 import util.utils as utils
 from .monitor import Monitor
+from .coverage import CoverageTracker
+from .lifecycle import PENDING
 
 log = utils.getLog(__name__)
 
 ONLINE_STATUS = "active_online"
-STATUS_LABELS = {"active_online": "*ONLINE* 👍", "active_offline": "*OFFLINE* 🔥"}
+STATUS_EVENTS = {
+    "active_online": alerts.ONLINE,
+    "active_offline": alerts.OFFLINE,
+    "exited": alerts.EXITED,
+    "slashed": alerts.SLASHED,
+}
+# Max wait between the checks of all the validators, relative to "polling_wait" (see "get_polling_waits")
+MAX_POLLING_WAIT_FACTOR = 2
+
+STATUS_LABELS = {
+    "active_online": "*ONLINE* 👍",
+    "active_offline": "*OFFLINE* 🔥",
+    "exited": "*EXITED* 👋",
+    "slashed": "*SLASHED* ⚔️",
+}
 
 
 class MonitorStatus(Monitor):
@@ -21,6 +42,10 @@ class MonitorStatus(Monitor):
         monitored_validators,
         batch_request_delay,
         notify_delay_seconds,
+        lifecycle,
+        hot_window_seconds=600,
+        hot_max_validators=0,
+        stale_cycles=None,
     ):
         Monitor.__init__(
             self,
@@ -29,41 +54,191 @@ class MonitorStatus(Monitor):
             notify_delay_seconds=notify_delay_seconds,
         )
         self.validators_online = {}
+        self.lifecycle = lifecycle
+        self.coverage = CoverageTracker("status", monitored_validators, stale_cycles)
+
+        # Last observed status of every validator, and an index of validators by status
+        self.validators_status = {}
+        self.validators_by_status = {}
+
+        # Hot validators: Waiting to notify, or with a recent transition. They can be polled more often (disabled if
+        # hot_max_validators is 0)
+        self.hot_window_seconds = hot_window_seconds
+        self.hot_max_validators = hot_max_validators
+        self.validators_last_transition = {}
+
+        # Validators to poll in the last check (including the hot ones), to keep the request volume
+        self.validators_to_poll_count = 0
+
+    def update_hot_settings(self, hot_window_seconds, hot_max_validators):
+        self.hot_window_seconds = hot_window_seconds
+        self.hot_max_validators = hot_max_validators
+
+    def get_hot_validators(self):
+        if self.hot_max_validators <= 0:
+            return []
+
+        # Forget the transitions that are not recent anymore
+        now = time.monotonic()
+        for index, last_transition in list(self.validators_last_transition.items()):
+            if now - last_transition > self.hot_window_seconds:
+                del self.validators_last_transition[index]
+
+        # Validators waiting to notify first (they are the ones pending confirmation)
+        hot_validators = list(self.validators_waiting_to_notify)
+        hot_validators += [
+            index
+            for index in self.validators_last_transition
+            if index not in self.validators_waiting_to_notify
+        ]
+        return hot_validators[: self.hot_max_validators]
+
+    def get_polling_waits(self, polling_wait, hot_polling_wait):
+        """
+        Returns the wait between the checks of all the validators, and between the checks of the hot validators. The
+        checks of all the validators wait longer, so the hot validators don't increase the request volume of polling
+        everything every "polling_wait" seconds. When waiting up to MAX_POLLING_WAIT_FACTOR times longer is not enough
+        (i.e. small fleets), the hot validators are polled less often too
+        """
+        hot_validators = self.get_hot_validators()
+        if not hot_validators or hot_polling_wait is None:
+            return polling_wait, hot_polling_wait
+
+        batches = math.ceil(self.validators_to_poll_count / utils.BATCH_SIZE)
+        if batches == 0:
+            return polling_wait, hot_polling_wait
+        hot_batches = math.ceil(len(hot_validators) / utils.BATCH_SIZE)
+        bulk_batches = math.ceil(
+            max(self.validators_to_poll_count - len(hot_validators), 0)
+            / utils.BATCH_SIZE
+        )
+
+        # Requests per second: polling all the validators, and polling the hot ones
+        requests_rate = batches / polling_wait
+        hot_requests_rate = hot_batches / hot_polling_wait
+        max_polling_wait = polling_wait * MAX_POLLING_WAIT_FACTOR
+        if requests_rate > hot_requests_rate:
+            bulk_polling_wait = bulk_batches / (requests_rate - hot_requests_rate)
+            if bulk_polling_wait <= max_polling_wait:
+                return max(polling_wait, bulk_polling_wait), hot_polling_wait
+
+        # Spend on the hot validators the requests left when waiting the max
+        hot_polling_wait = max(
+            hot_polling_wait,
+            hot_batches * max_polling_wait / (requests_rate * max_polling_wait - bulk_batches),
+        )
+        return max_polling_wait, hot_polling_wait
 
     async def check(self):
         log.debug("Check State of Validators")
+        started = time.monotonic()
+
+        # Get current state of validators (exited and pending validators are polled less often)
+        self.lifecycle.next_cycle()
+        validators_to_poll = self.lifecycle.get_validators_to_poll(
+            self.monitored_validators, self.validators_waiting_to_notify
+        )
+
+        # Hot validators are polled separately (see check_hot_validators)
+        self.validators_to_poll_count = len(validators_to_poll)
+        hot_validators = set(self.get_hot_validators())
+        if hot_validators:
+            validators_to_poll = [
+                index for index in validators_to_poll if index not in hot_validators
+            ]
+
+        self.coverage.start_cycle(validators_to_poll)
+        await self.__check_validators(validators_to_poll)
+        self.record_check_time(started)
+        await self.report_coverage()
 
-        # Get current state of validators
-        validators_state = validators.get_validators_state(
-            validators=self.monitored_validators,
+        # Report the number of validators in each state of their lifecycle
+        for state, validators_count in self.lifecycle.get_validators_count().items():
+            prometheus.validators_lifecycle_gauge.labels(state=state).set(
+                validators_count
+            )
+
+        # Get the activation epoch of the pending validators
+        try:
+            await self.lifecycle.update_activation_epochs()
+        except Exception:
+            log.error(traceback.format_exc())
+            log.error("Error getting the activation epoch of pending validators")
+
+    async def check_hot_validators(self):
+        """
+        Checks only the hot validators (waiting to notify, or with a recent transition), so the alerts are confirmed
+        (or discarded) without waiting for the check of all the validators
+        """
+        hot_validators = self.get_hot_validators()
+        prometheus.hot_validators_gauge.set(len(hot_validators))
+        if not hot_validators:
+            return
+
+        log.debug(f"Check State of {len(hot_validators)} hot validators")
+        self.coverage.expect(hot_validators)
+        await self.__check_validators(hot_validators)
+
+    async def __check_validators(self, validators_to_poll):
+        validators_state = await validators.get_validators_state(
+            validators=validators_to_poll,
             batch_request_delay=self.batch_request_delay,
         )
 
         # Detect validators changing state
         validators_change_state = self.__get_validators_change_state(validators_state)
 
-        # Update the notification waiting list
-        validator_change_state_indexes = [
-            item for sublist in validators_change_state.values() for item in sublist
-        ]
-        max_waiting_to_notify = super().update_validators_waiting_to_notify(
-            validator_change_state_indexes
+        # Get the validators that waited enough since they changed
+        validators_to_notify = super().pop_validators_to_notify(
+            {
+                index
+                for validators_index in validators_change_state.values()
+                for index in validators_index
+            }
         )
 
-        # Decide if we should notify
-        notify, reset_delay_counter = super().should_notify_change_state(
-            max_waiting_to_notify
+        # Update state, and notify all the changes of state
+        await self.__update_validator_state_and_notify(
+            validators_change_state, validators_to_notify
         )
 
-        # Reset the notification delay counter
-        if reset_delay_counter or notify:
-            self.validators_waiting_to_notify = {}
+    def forget_validator(self, index):
+        super().forget_validator(index)
+        self.validators_online.pop(index, None)
+        self.validators_last_transition.pop(index, None)
+        self.lifecycle.forget(index)
+        self.__update_observed_status(index, None)
+        try:
+            prometheus.validator_up_gauge.remove(index)
+        except KeyError:
+            pass
 
-        # Update state, and notify all the changes of state
-        await self.__update_validator_state_and_notify(validators_change_state, notify)
+    def __update_observed_status(self, index, status):
+        previous_status = self.validators_status.get(index, None)
+        if previous_status == status:
+            return
+
+        if previous_status is not None:
+            self.validators_by_status[previous_status].discard(index)
+            if not self.validators_by_status[previous_status]:
+                del self.validators_by_status[previous_status]
 
+            # Keep track of the recent transitions (hot validators)
+            if status is not None:
+                self.validators_last_transition[index] = time.monotonic()
+
+        if status is None:
+            # Validator no longer monitored
+            del self.validators_status[index]
+            return
+
+        self.validators_status[index] = status
+        self.validators_by_status.setdefault(status, set()).add(index)
+
+    @tracing.traced("get_validators_change_state")
     def __get_validators_change_state(self, validators_state):
         validators_change_state = {}
+        validators_recovered = []
         for validator_state in validators_state:
             index = validator_state["index"]
             status = validator_state["status"]
@@ -74,10 +249,19 @@ class MonitorStatus(Monitor):
 
             is_online = status == ONLINE_STATUS
             prometheus.validator_up_gauge.labels(index=index).set(is_online)
+            self.coverage.observe(index)
+            self.__update_observed_status(index, status)
 
-            # Check if there are status changes
+            # Check if there are status changes (pending validators are not reported until they are activated)
+            lifecycle_state = self.lifecycle.update(index, status)
             previous_status = self.validators_online.get(index, ONLINE_STATUS)
-            if status == previous_status:
+            changed = status != previous_status and lifecycle_state != PENDING
+
+            # Update the notification waiting list
+            if super().update_validator_waiting_to_notify(index, changed):
+                validators_recovered.append(index)
+
+            if not changed:
                 # No change in the status from last check
                 continue
 
@@ -87,6 +271,7 @@ class MonitorStatus(Monitor):
             # Append the validator the list of validator that changed
             validators_change_state[status].append(index)
 
+        super().log_recovered_validators(validators_recovered)
         return validators_change_state
 
     # def __register_validator_waiting_time_notify(self, validators_change_state):
@@ -131,22 +316,38 @@ class MonitorStatus(Monitor):
     #     return max_waiting_to_notify
 
     async def __update_validator_state_and_notify(
-        self, validators_change_state, notify
+        self, validators_change_state, validators_to_notify
     ):
         # Update state, and notify all the changes of state
         for status, validators_index in validators_change_state.items():
-            if notify:
-                # Change the status for the validator (only when we are also notifying)
-                for index in validators_index:
-                    self.validators_online[index] = status
+            validators_notify = [
+                index for index in validators_index if index in validators_to_notify
+            ]
+            validators_wait = [
+                index for index in validators_index if index not in validators_to_notify
+            ]
+
+            # Change the status for the validator (only when we are also notifying)
+            for index in validators_notify:
+                self.validators_online[index] = status
 
             # Notify validator changes
             status_label = (
                 STATUS_LABELS[status] if status in STATUS_LABELS else status + "??"
             )
-            message_base = (
-                f"{len(validators_index)} Validators changed to {status_label}: "
-            )
-            await messages.send_message_validators(
-                message_base, validators_index, notify
-            )
+            for validators_group, notify in (
+                (validators_notify, True),
+                (validators_wait, False),
+            ):
+                if not validators_group:
+                    continue
+
+                message_base = (
+                    f"{len(validators_group)} Validators changed to {status_label}: "
+                )
+                await messages.send_message_validators(
+                    message_base,
+                    validators_group,
+                    notify,
+                    STATUS_EVENTS.get(status, alerts.STATUS_CHANGED),
+                )
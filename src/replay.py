@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+import time
+
+import util.utils as utils
+import util.capture as capture
+import util.messages as messages
+import util.validators as validators
+import monitor.monitor_status as monitor_status
+import monitor.monitor_effectiveness as monitor_effectiveness
+import monitor.lifecycle as lifecycle
+
+log = utils.getLog(__name__)
+
+# Replays a capture recorded with the "capture" config (mode "record") through the monitors, without network
+#   i.e. python src/replay.py capture.jsonl.gz --speed 10 --cycles 5
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Replay a capture of the Beacon Chain API requests through the monitors"
+    )
+    parser.add_argument("capture_file", help="Capture file (i.e. capture.jsonl.gz)")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Replay speed (1 is real time, 0 replays without delays)",
+    )
+    parser.add_argument(
+        "--cycles", type=int, default=1, help="Number of checks to replay"
+    )
+    return parser.parse_args()
+
+
+async def replay(capture_file, speed, cycles):
+    capture.replayer = capture.CaptureReplayer(capture_file, speed)
+    messages.disable_notifications()
+
+    # Config: Health check
+    check_health_config = utils.config.get("check_health", {})
+    notify_delay_seconds = check_health_config.get("notify_delay_seconds", 300)
+    notify_effectiveness_threshold = check_health_config.get(
+        "notify_effectiveness_threshold", None
+    )
+
+    started = time.monotonic()
+    monitored_validators = validators.get_validators()
+    log.info(
+        f"Resolved {len(monitored_validators)} validators in {time.monotonic() - started:.3f}s"
+    )
+
+    validators_lifecycle = lifecycle.ValidatorLifecycle(
+        terminal_polling_cycles=check_health_config.get("terminal_polling_cycles", 60),
+        pending_polling_cycles=check_health_config.get("pending_polling_cycles", 10),
+    )
+    validator_monitor = monitor_status.MonitorStatus(
+        monitored_validators=monitored_validators,
+        batch_request_delay=0,
+        notify_delay_seconds=notify_delay_seconds,
+        lifecycle=validators_lifecycle,
+    )
+    validator_effectiveness = monitor_effectiveness.MonitorEffectiveness(
+        monitored_validators=monitored_validators,
+        notify_effectiveness_threshold=notify_effectiveness_threshold,
+        batch_request_delay=0,
+        notify_delay_seconds=notify_delay_seconds,
+        lifecycle=validators_lifecycle,
+    )
+
+    for cycle in range(1, cycles + 1):
+        await validator_monitor.check()
+        await validator_effectiveness.check()
+        log.info(
+            f"Cycle {cycle}: status check {validator_monitor.last_check_seconds:.3f}s, effectiveness check {validator_effectiveness.last_check_seconds:.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(replay(args.capture_file, args.speed, args.cycles))
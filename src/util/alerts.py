@@ -0,0 +1,253 @@
+import backoff
+import datetime
+import json
+import requests
+import util.messages as messages
+import util.prometheus as prometheus
+import util.utils as utils
+
+log = utils.getLog(__name__)
+
+# Events
+RESTARTED = "restarted"
+SHUTDOWN = "shutdown"
+MONITORING = "monitoring"
+ERROR = "error"
+WATCHDOG = "watchdog"
+ONLINE = "online"
+OFFLINE = "offline"
+EXITED = "exited"
+SLASHED = "slashed"
+STATUS_CHANGED = "status_changed"
+EFFECTIVENESS_OK = "effectiveness_ok"
+EFFECTIVENESS_CRITICAL = "effectiveness_critical"
+PROPOSAL_MISSED = "proposal_missed"
+SYNC_OK = "sync_ok"
+SYNC_LOW = "sync_low"
+STALE = "stale"
+UNRESOLVED = "unresolved"
+
+# Severities
+CRITICAL = "critical"
+WARNING = "warning"
+INFO = "info"
+
+EVENT_SEVERITIES = {
+    RESTARTED: WARNING,
+    SHUTDOWN: WARNING,
+    MONITORING: INFO,
+    ERROR: CRITICAL,
+    WATCHDOG: CRITICAL,
+    ONLINE: INFO,
+    OFFLINE: CRITICAL,
+    EXITED: WARNING,
+    SLASHED: CRITICAL,
+    STATUS_CHANGED: WARNING,
+    EFFECTIVENESS_OK: INFO,
+    EFFECTIVENESS_CRITICAL: CRITICAL,
+    PROPOSAL_MISSED: CRITICAL,
+    SYNC_OK: INFO,
+    SYNC_LOW: WARNING,
+    STALE: WARNING,
+    UNRESOLVED: CRITICAL,
+}
+
+# Route used for the events without their own route
+DEFAULT_ROUTE = "default"
+
+# Max length of a digest message (Telegram messages are limited to 4096 characters), leaving room for the last line.
+# Longer digests are split in several messages, up to MAX_DIGEST_MESSAGES (the rest of the events are only counted)
+MAX_DIGEST_MESSAGE_LENGTH = 4000
+MAX_DIGEST_MESSAGES = 5
+
+# Config (see "setup")
+sinks = {}
+routes = {}
+digest_severities = []
+digest_interval_seconds = 300
+
+
+class TelegramSink:
+    """
+    Sends the alerts to a Telegram chat (by default, the one of the "telegram" config)
+    """
+
+    def __init__(self, chat_id=None):
+        self.chat_id = chat_id
+        self.digest = []
+
+    async def send(self, event, message):
+        await messages.send_message(message, chat_id=self.chat_id)
+
+
+class WebhookSink:
+    """
+    Posts the alerts to a URL, as JSON: {"event", "severity", "time", "message"}. The message is plain text
+    """
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+        self.digest = []
+
+    async def send(self, event, message):
+        payload = {
+            "event": event,
+            "severity": get_severity(event),
+            "time": datetime.datetime.now().isoformat(),
+            "message": messages.to_plain_text(message),
+        }
+        await utils.run_in_thread(self.post, payload)
+
+    @backoff.on_exception(backoff.expo, Exception, max_tries=5)
+    def post(self, payload):
+        res = requests.post(self.url, json=payload, timeout=self.timeout)
+        res.raise_for_status()
+
+
+class FileSink:
+    """
+    Appends the alerts to a file (one JSON per line, with the message in plain text). Useful for tests
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.digest = []
+
+    async def send(self, event, message):
+        line = json.dumps(
+            {
+                "event": event,
+                "severity": get_severity(event),
+                "time": datetime.datetime.now().isoformat(),
+                "message": messages.to_plain_text(message),
+            },
+            ensure_ascii=False,
+        )
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+SINK_TYPES = {
+    "telegram": TelegramSink,
+    "webhook": WebhookSink,
+    "file": FileSink,
+}
+
+
+def create_sink(name, sink_config):
+    sink_config = dict(sink_config)
+    sink_type = sink_config.pop("type", None)
+    if sink_type not in SINK_TYPES:
+        raise Exception(
+            f'Unknown type "{sink_type}" for the alerts sink "{name}". Use one of: {", ".join(SINK_TYPES)}'
+        )
+    return SINK_TYPES[sink_type](**sink_config)
+
+
+def setup(alerts_config):
+    """
+    Creates the sinks and routes of the alerts. Without config, all the alerts are sent to the Telegram chat right away
+    """
+    global sinks, routes, digest_severities, digest_interval_seconds
+    if alerts_config is None:
+        new_sinks = {"telegram": TelegramSink()}
+        new_routes = {DEFAULT_ROUTE: ["telegram"]}
+        new_digest_severities = []
+        new_digest_interval_seconds = 300
+    else:
+        new_sinks = {
+            name: create_sink(name, sink_config)
+            for name, sink_config in alerts_config.get("sinks", {}).items()
+        }
+        new_routes = alerts_config.get("routes", {DEFAULT_ROUTE: list(new_sinks)})
+        for event, route in new_routes.items():
+            unknown_sinks = [name for name in route if name not in new_sinks]
+            if unknown_sinks:
+                raise Exception(
+                    f'Unknown alerts sinks for the route "{event}": {", ".join(unknown_sinks)}'
+                )
+        digest_config = alerts_config.get("digest", {})
+        new_digest_severities = digest_config.get("severities", [INFO])
+        new_digest_interval_seconds = digest_config.get("interval_seconds", 300)
+
+    # Keep the pending digests of the sinks that are still configured
+    for name, sink in new_sinks.items():
+        if name in sinks:
+            sink.digest = sinks[name].digest
+
+    sinks = new_sinks
+    routes = new_routes
+    digest_severities = new_digest_severities
+    digest_interval_seconds = new_digest_interval_seconds
+
+
+def get_severity(event):
+    return EVENT_SEVERITIES.get(event, WARNING)
+
+
+def get_route(event):
+    return routes.get(event, routes.get(DEFAULT_ROUTE, []))
+
+
+async def notify(event, message):
+    """
+    Sends the alert to the sinks of its route. The alerts with a digest severity are kept, and sent together in the next
+    digest
+    """
+    if not sinks:
+        setup(None)
+
+    is_digested = get_severity(event) in digest_severities
+    for name in get_route(event):
+        sink = sinks[name]
+        if is_digested:
+            sink.digest.append((event, message))
+            prometheus.alerts_digested_counter.labels(sink=name).inc()
+            continue
+
+        await send(name, sink, event, message)
+
+
+async def send(name, sink, event, message):
+    try:
+        await sink.send(event, message)
+        prometheus.alerts_sent_counter.labels(sink=name).inc()
+    except Exception as e:
+        log.error(f'Error sending the "{event}" alert to "{name}": {repr(e)}')
+
+
+async def flush_digests():
+    """
+    Sends the pending digests of the sinks (split in several messages if they are long)
+    """
+    for name, sink in list(sinks.items()):
+        if not sink.digest:
+            continue
+
+        events, sink.digest = sink.digest, []
+        for message in get_digest_messages(events):
+            await send(name, sink, "digest", message)
+
+
+def get_digest_messages(events):
+    """
+    Lists the events of a digest, split in messages of at most MAX_DIGEST_MESSAGE_LENGTH characters
+    """
+    messages_lines = []
+    lines = [f"🗒 *DIGEST*: {len(events)} alerts"]
+    length = len(lines[0])
+    for position, (_, message) in enumerate(events):
+        line = f"\\- {message}"
+        if length + len(line) + 1 > MAX_DIGEST_MESSAGE_LENGTH:
+            if len(messages_lines) + 1 == MAX_DIGEST_MESSAGES:
+                lines.append(f"\\.\\.\\.and {len(events) - position} more")
+                break
+
+            messages_lines.append(lines)
+            lines = ["🗒 *DIGEST* \\(continued\\)"]
+            length = len(lines[0])
+        lines.append(line)
+        length += len(line) + 1
+    messages_lines.append(lines)
+    return ["\n".join(lines) for lines in messages_lines]
@@ -0,0 +1,200 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import util.tracing as tracing
+import util.utils as utils
+
+log = utils.getLog(__name__)
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+DEFAULT_PROFILE_SECONDS = 10
+
+# Monitors exposed by the API (registered on startup)
+validator_monitor = None
+validator_effectiveness = None
+
+
+def register_monitors(monitor_status, monitor_effectiveness):
+    global validator_monitor, validator_effectiveness
+    validator_monitor = monitor_status
+    validator_effectiveness = monitor_effectiveness
+
+
+class QueryError(Exception):
+    pass
+
+
+def format_time(value):
+    return value.isoformat() if value is not None else None
+
+
+def to_index(index):
+    # The effectiveness monitor keeps the indexes as strings
+    return int(index) if str(index).isdigit() else index
+
+
+def get_int_param(params, name, default):
+    value = params.get(name, [None])[0]
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise QueryError(f'Parameter "{name}" must be an integer')
+
+
+def get_validators_with_status(status):
+    # Accept both the full status (i.e. "active_offline") and the short one (i.e. "offline")
+    validators_by_status = validator_monitor.validators_by_status
+    indexes = set()
+    for validator_status, validators_index in list(validators_by_status.items()):
+        if validator_status == status or validator_status.endswith("_" + status):
+            indexes.update(validators_index)
+    return indexes
+
+
+def get_validator(index):
+    index_str = str(index)
+    waiting_status = validator_monitor.validators_waiting_to_notify.get(index, None)
+    waiting_effectiveness = validator_effectiveness.validators_waiting_to_notify.get(
+        index_str, None
+    )
+    return {
+        "index": index,
+        "status": validator_monitor.validators_status.get(index, None),
+        "lifecycle": validator_monitor.lifecycle.states.get(index, None),
+        "effectiveness": validator_effectiveness.validators_effectiveness.get(
+            index_str, None
+        ),
+        "pending_status_notification_since": format_time(waiting_status),
+        "pending_effectiveness_notification_since": format_time(
+            waiting_effectiveness
+        ),
+    }
+
+
+def query_validators(params):
+    status = params.get("status", [None])[0]
+    effectiveness_lt = params.get("effectiveness_lt", [None])[0]
+    offset = max(get_int_param(params, "offset", 0), 0)
+    limit = min(max(get_int_param(params, "limit", DEFAULT_PAGE_LIMIT), 1), MAX_PAGE_LIMIT)
+
+    # Resolve the filters using the indexes kept by the monitors
+    indexes = None
+    if status is not None:
+        indexes = get_validators_with_status(status)
+
+    if effectiveness_lt is not None:
+        try:
+            max_effectiveness = float(effectiveness_lt)
+        except ValueError:
+            raise QueryError('Parameter "effectiveness_lt" must be a number')
+        below_threshold = {
+            to_index(index)
+            for index in validator_effectiveness.get_validators_below_effectiveness(
+                max_effectiveness
+            )
+        }
+        indexes = below_threshold if indexes is None else indexes & below_threshold
+
+    if indexes is None:
+        indexes = validator_monitor.monitored_validators
+
+    indexes = sorted(indexes)
+    return {
+        "total": len(indexes),
+        "offset": offset,
+        "limit": limit,
+        "data": [get_validator(index) for index in indexes[offset : offset + limit]],
+    }
+
+
+def get_pending_notifications():
+    def pending(monitor):
+        return [
+            {"index": to_index(index), "since": format_time(since)}
+            for index, since in sorted(
+                list(monitor.validators_waiting_to_notify.items()),
+                key=lambda item: to_index(item[0]),
+            )
+        ]
+
+    return {
+        "status": pending(validator_monitor),
+        "effectiveness": pending(validator_effectiveness),
+    }
+
+
+def get_checks():
+    def check_info(monitor):
+        return {
+            "last_check_at": format_time(monitor.last_check_at),
+            "last_check_seconds": monitor.last_check_seconds,
+        }
+
+    return {
+        "status": check_info(validator_monitor),
+        "effectiveness": check_info(validator_effectiveness),
+    }
+
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        path = url.path.rstrip("/")
+
+        if validator_monitor is None or validator_effectiveness is None:
+            return self.send_json(503, {"error": "The monitor is starting"})
+
+        try:
+            if path == "/debug/profile":
+                # Sample the stacks for some seconds (collapsed format, for flame graphs)
+                seconds = get_int_param(params, "seconds", DEFAULT_PROFILE_SECONDS)
+                return self.send_text(200, tracing.sample_stacks(seconds))
+            if path == "/validators":
+                return self.send_json(200, query_validators(params))
+            elif path.startswith("/validators/"):
+                index = path[len("/validators/") :]
+                if not index.isdigit():
+                    raise QueryError(f"Invalid validator index: {index}")
+                return self.send_json(200, get_validator(int(index)))
+            elif path == "/pending":
+                return self.send_json(200, get_pending_notifications())
+            elif path == "/checks":
+                return self.send_json(200, get_checks())
+            else:
+                return self.send_json(404, {"error": f"Not found: {url.path}"})
+        except QueryError as e:
+            return self.send_json(400, {"error": str(e)})
+
+    def send_json(self, code, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, code, text):
+        body = text.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+def start_http_server(port=8001):
+    log.info(
+        f"Start query API server in port {port}. API available in http://localhost:{port}/validators"
+    )
+    server = ThreadingHTTPServer(("", port), ApiRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
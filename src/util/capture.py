@@ -0,0 +1,139 @@
+import gzip
+import json
+import threading
+import time
+import util.utils as utils
+
+log = utils.getLog(__name__)
+
+# Flush the capture file every some records (flushing compressed data on every record hurts the compression)
+FLUSH_EVERY_RECORDS = 100
+
+# Active recorder/replayer (if any)
+recorder = None
+replayer = None
+
+
+class CaptureRecorder:
+    """
+    Records the requests to the Beacon Chain API (with their timings) in a compressed JSON lines file
+    """
+
+    def __init__(self, capture_file):
+        self.capture_file = capture_file
+        self.file = gzip.open(capture_file, "at", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.records = 0
+
+    def record(self, base_api, path, started, elapsed, response=None, error=None):
+        line = json.dumps(
+            {
+                "time": started,
+                "elapsed": elapsed,
+                "base_api": base_api,
+                "path": path,
+                "response": response,
+                "error": error,
+            }
+        )
+        with self.lock:
+            self.file.write(line + "\n")
+            self.records += 1
+            if self.records % FLUSH_EVERY_RECORDS == 0:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+        log.info(f"Recorded {self.records} requests in {self.capture_file}")
+
+
+def read_records(capture_file):
+    """
+    Reads the records of a capture file. The capture of a process killed without closing it (i.e. SIGKILL or OOM) has
+    no end of stream marker, so the records are read up to the last complete one
+    """
+    with gzip.open(capture_file, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    log.warning(
+                        f"Ignoring a truncated record of {capture_file}, the capture was not closed"
+                    )
+                    return
+                yield record
+        except EOFError:
+            log.warning(
+                f"The capture {capture_file} was not closed (the recording process was killed?). Using the records read so far"
+            )
+
+
+class CaptureReplayer:
+    """
+    Replays the responses of a capture file. Requests for the same URL get the recorded responses in order (starting
+    over when they run out). A speed of 0 replays without delays
+    """
+
+    def __init__(self, capture_file, speed=1.0):
+        self.capture_file = capture_file
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.positions = {}
+
+        records = 0
+        for record in read_records(capture_file):
+            key = (record["base_api"], record["path"])
+            self.responses.setdefault(key, []).append(record)
+            records += 1
+        log.info(
+            f"Replaying {records} requests ({len(self.responses)} different URLs) from {capture_file} (speed={speed})"
+        )
+
+    def get_json(self, base_api, path):
+        key = (base_api, path)
+        if key not in self.responses:
+            raise Exception(f"Request not found in the capture: {base_api}{path}")
+
+        with self.lock:
+            records = self.responses[key]
+            position = self.positions.get(key, 0)
+            self.positions[key] = (position + 1) % len(records)
+        record = records[position]
+
+        # Simulate the latency of the recorded request
+        if self.speed > 0:
+            time.sleep(record["elapsed"] / self.speed)
+
+        if record["error"] is not None:
+            raise Exception(f"Replayed error: {record['error']}")
+
+        return record["response"]
+
+
+def setup(capture_config):
+    global recorder, replayer
+    if capture_config is None:
+        return
+
+    mode = capture_config.get("mode", None)
+    capture_file = capture_config.get("file", "capture.jsonl.gz")
+    if mode == "record":
+        log.warning(f"Recording the Beacon Chain API requests in {capture_file}")
+        recorder = CaptureRecorder(capture_file)
+    elif mode == "replay":
+        log.warning(
+            f"Replaying the Beacon Chain API requests from {capture_file}. No request will be sent to the API"
+        )
+        replayer = CaptureReplayer(capture_file, capture_config.get("speed", 1.0))
+    else:
+        raise Exception(f'Unknown capture mode "{mode}". Use "record" or "replay"')
+
+
+def close():
+    global recorder
+    if recorder is not None:
+        recorder.close()
+        recorder = None
@@ -1,7 +1,10 @@
 from os import access
 import backoff
-import telegram
 import asyncio
+import re
+import threading
+import util.alerts as alerts
+import util.tracing as tracing
 import util.utils as utils
 import util.validators as validators
 from itertools import islice
@@ -9,9 +12,41 @@ from itertools import islice
 log = utils.getLog(__name__)
 
 SPECIAL_SYMBOLS = [".", "(", ")", "~", "!"]
+MARKDOWN_ESCAPE_TABLE = str.maketrans({symbol: "\\" + symbol for symbol in SPECIAL_SYMBOLS})
+
+# MarkdownV2 escapes, links and formatting symbols (see "to_plain_text")
+MARKDOWN_PLAIN_PATTERN = re.compile(
+    r"\\(.)|\[((?:\\.|[^\\\]])*)\]\((?:\\.|[^\\)])*\)|[*_`~|]"
+)
+
+# Max number of validators listed in a message
+MAX_VALIDATORS_IN_MESSAGE = 20
 
 
 def get_bot():
+    # Create the bot the first time it's used (importing "telegram" is slow)
+    global chat_id, bot, bot_initialized
+    with bot_lock:
+        if not bot_initialized:
+            chat_id, bot = create_bot()
+            bot_initialized = True
+    return chat_id, bot
+
+
+def disable_notifications():
+    # Log the messages instead of sending them (i.e. when replaying a capture)
+    global chat_id, bot, bot_initialized
+    with bot_lock:
+        chat_id, bot = None, None
+        bot_initialized = True
+
+
+def is_enabled():
+    _, bot = get_bot()
+    return bot is not None
+
+
+def create_bot():
     # Config
     telegram_config = utils.config.get("telegram", None)
 
@@ -23,6 +58,8 @@ def get_bot():
             f"Connect to Telegram. chat_id: {chat_id}, access_token={access_token[:4]}...{access_token[-4:]}"
         )
         if access_token is not None and chat_id is not None:
+            import telegram
+
             return chat_id, telegram.Bot(token=access_token)
         else:
             log.warning(
@@ -37,13 +74,17 @@ def get_bot():
 
 
 @backoff.on_exception(backoff.expo, Exception, max_tries=10)
-async def send_message(message, parse_mode="MarkdownV2", scape=False):
+async def send_message(message, parse_mode="MarkdownV2", scape=False, chat_id=None):
     
     # https://core.telegram.org/bots/api#markdownv2-style
     if scape:
         message = scape_markdown(message)
-    
+
+    default_chat_id, bot = get_bot()
+    chat_id = chat_id if chat_id is not None else default_chat_id
     if bot is not None:
+        import telegram
+
         async with bot:
             try:
               await bot.send_message(chat_id=chat_id, text=message, parse_mode=parse_mode)
@@ -55,10 +96,15 @@ async def send_message(message, parse_mode="MarkdownV2", scape=False):
 
 @backoff.on_exception(backoff.expo, Exception, max_tries=10)
 async def get_user():
+    # Create the bot in a thread, so the first check can start meanwhile
+    chat_id, bot = await utils.run_in_thread(get_bot)
     if bot is not None:
         async with bot:
             return await bot.get_me()
     else:
+        import telegram
+
+
         return telegram.User(
             id=0, first_name="Mock Logger", username="MessageLogger", is_bot=False
         )
@@ -67,31 +113,90 @@ async def get_user():
 
 
 def scape_markdown(message):
-    return utils.escape_special_symbols(message, SPECIAL_SYMBOLS)
-
-async def send_message_validators(message_base, validators_list, notify):
-    if len(validators_list) <= 20:
-        validators_to_notify = validators_list
-        message_end = ""    
-    else:
-        validators_to_notify = islice(validators_list, 20)
-        message_end = f"...and {len(validators_list)} more."
-        
-
-    validators_str = ", ".join([str(index) for index in validators_list])
-    validators_markdown = ", ".join(
-        [
-            "[" + str(index) + "](" + validators.get_validator_url(index) + ")"
-            for index in validators_list
-        ]
+    return message.translate(MARKDOWN_ESCAPE_TABLE)
+
+
+def to_plain_text(message):
+    """
+    Strips the MarkdownV2 of a message (escapes, formatting and links), for the alerts sinks that are not Telegram
+    """
+
+    def replace(match):
+        if match.group(1) is not None:
+            return match.group(1)
+        if match.group(2) is not None:
+            return to_plain_text(match.group(2))
+        return ""
+
+    return MARKDOWN_PLAIN_PATTERN.sub(replace, message)
+
+
+class LazyJoin:
+    """
+    Joins the validators only if the log record is emitted
+    """
+
+    def __init__(self, validators_list):
+        self.validators_list = validators_list
+
+    def __str__(self):
+        return ", ".join([str(index) for index in self.validators_list])
+
+
+def render_validators(validators_list):
+    """
+    Renders the markdown link of the validators (done once, when the monitored validators change)
+    """
+    global validators_markdown, validators_markdown_base_url
+    validators_markdown_base_url = validators.get_base_url()
+    validators_markdown = {
+        index: f"[{index}]({validators.get_validator_url(index)})"
+        for index in validators_list
+    }
+
+
+def get_validator_markdown(index):
+    # The monitors use int or str indexes (i.e. the effectiveness monitor)
+    index = int(index)
+    if validators_markdown_base_url != validators.get_base_url():
+        # The base URL changed (config reloaded)
+        render_validators(list(validators_markdown))
+
+    markdown = validators_markdown.get(index, None)
+    if markdown is None:
+        markdown = f"[{index}]({validators.get_validator_url(index)})"
+        validators_markdown[index] = markdown
+    return markdown
+
+
+@tracing.traced("send_message_validators")
+async def send_message_validators(message_base, validators_list, notify, event):
+    # Only the first validators are shown, so the cost doesn't depend on the number of validators
+    validators_shown = list(islice(validators_list, MAX_VALIDATORS_IN_MESSAGE))
+    validators_more = len(validators_list) - len(validators_shown)
+    message_end = f", ...and {validators_more} more." if validators_more else ""
+
+    log.info(
+        "%s%s%s%s",
+        message_base,
+        LazyJoin(validators_shown),
+        message_end,
+        "" if notify else " (don't notify yet)",
     )
-
-    log.info(message_base + validators_str + ("" if notify else " (don't notify yet)"))
+    if validators_more:
+        log.debug("%sAll the validators: %s", message_base, LazyJoin(validators_list))
 
     if notify:
         try:
-            message_base_safe = scape_markdown(message_base)
-            await send_message(message_base_safe + validators_markdown + message_end)
+            validators_markdown_str = ", ".join(
+                [get_validator_markdown(index) for index in validators_shown]
+            )
+            await alerts.notify(
+                event,
+                scape_markdown(message_base)
+                + validators_markdown_str
+                + scape_markdown(message_end),
+            )
         except:
             log.error("Error notifying change")
 
@@ -106,4 +211,10 @@ if __name__ == "__main__":
     asyncio.run(main())
 
 
-chat_id, bot = get_bot()
+chat_id, bot = None, None
+bot_initialized = False
+bot_lock = threading.Lock()
+
+# Markdown links of the validators (index -> markdown), and the base URL used to render them
+validators_markdown = {}
+validators_markdown_base_url = None
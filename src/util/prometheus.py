@@ -3,6 +3,7 @@ from prometheus_client import (
     Summary,
     Counter,
     Gauge,
+    Histogram,
     Info,
 )
 import util.utils as utils
@@ -27,6 +28,11 @@ main_loop_consecutive_errors_gauge = Gauge(
     "Number of consecutive errors are currently accumulated for the last main loop executions",
 )
 
+startup_seconds_gauge = Gauge(
+    PREFIX + "startup_seconds",
+    "Time it took from the start of the process until the first check was done",
+)
+
 check_time_summary = Summary(
     PREFIX + "check_seconds",
     "Time it takes to check and report the state of all the validators in every run loop",
@@ -42,6 +48,27 @@ bc_http_request_success_counter = Counter(
     "Number of successful GET request to the Beacon Chain REST API",
 )
 
+validators_lifecycle_gauge = Gauge(
+    PREFIX + "validators_lifecycle",
+    "Number of validators in each state of their lifecycle (pending, active, exiting, exited, slashed)",
+    ["state"],
+)
+
+hot_validators_gauge = Gauge(
+    PREFIX + "hot_validators",
+    "Number of validators polled more often because they are waiting to notify a change, or had a recent transition",
+)
+
+backfill_progress_gauge = Gauge(
+    PREFIX + "backfill_progress_ratio",
+    "Progress resolving the public keys of the validators on startup, between 0 and 1",
+)
+
+backfill_failed_public_keys_gauge = Gauge(
+    PREFIX + "backfill_failed_public_keys",
+    "Number of public keys that couldn't be resolved on startup (they are retried in the background)",
+)
+
 validator_up_gauge = Gauge(
     PREFIX + "validator_up",
     "Validator efectiviness expressed in percent 0..1",
@@ -55,6 +82,70 @@ validator_effectiveness_gauge = Gauge(
 )
 
 
+span_time_histogram = Histogram(
+    PREFIX + "span_seconds",
+    "Time spent in the instrumented parts of the check (only when profiling is enabled)",
+    ["span"],
+)
+
+
+validator_proposals_counter = Counter(
+    PREFIX + "validator_proposals",
+    "Number of blocks proposed by the validator (only when duties are checked)",
+    ["index"],
+)
+
+validator_missed_proposals_counter = Counter(
+    PREFIX + "validator_missed_proposals",
+    "Number of block proposals missed by the validator (only when duties are checked)",
+    ["index"],
+)
+
+validator_sync_participation_gauge = Gauge(
+    PREFIX + "validator_sync_participation_ratio",
+    "Participation of the validator in the sync committee in the last epoch, between 0 and 1 (only when in the sync committee)",
+    ["index"],
+)
+
+
+coverage_gauge = Gauge(
+    PREFIX + "coverage_ratio",
+    "Ratio of the requested validators that were observed in the last check, between 0 and 1",
+    ["check"],
+)
+
+stale_validators_gauge = Gauge(
+    PREFIX + "stale_validators",
+    "Number of validators not observed in the last checks (i.e. their batch failed), so their metrics are stale",
+    ["check"],
+)
+
+observation_age_histogram = Histogram(
+    PREFIX + "observation_age_seconds",
+    "Time since the previous observation of a validator, every time it's observed by a check",
+    ["check"],
+    buckets=(30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400, float("inf")),
+)
+
+oldest_observation_age_gauge = Gauge(
+    PREFIX + "oldest_observation_age_seconds",
+    "Time since the oldest observation of the validators missed in the last check (or since they are monitored, if never observed). 0 if none was missed",
+    ["check"],
+)
+
+alerts_sent_counter = Counter(
+    PREFIX + "alerts_sent",
+    "Number of alerts (or digests) sent to each sink",
+    ["sink"],
+)
+
+alerts_digested_counter = Counter(
+    PREFIX + "alerts_digested",
+    "Number of low severity alerts added to the digest of each sink",
+    ["sink"],
+)
+
+
 def start_http_server(port=8000):
     log.info(
         f"Start Prometheus server in port {port}. Metrics available in http://localhost:{port}"
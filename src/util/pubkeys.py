@@ -0,0 +1,133 @@
+import json
+import mmap
+import os
+import util.utils as utils
+
+log = utils.getLog(__name__)
+
+PUBLIC_KEY_LENGTH = 48
+
+# Max number of invalid public keys shown in the logs
+MAX_INVALID_KEYS_LOGGED = 5
+
+# Last loaded public keys: (public keys in the config, files signature, public keys). Reused while they don't change
+loaded_public_keys = None
+
+
+def normalize_public_key(public_key):
+    """
+    Returns the public key as 48 bytes. Accepts hex strings (with or without "0x"), and integers (YAML parses the
+    unquoted hex keys as integers, dropping their leading zeros)
+    """
+    if isinstance(public_key, bool):
+        raise ValueError(f"Invalid public key: {public_key}")
+
+    if isinstance(public_key, int):
+        if public_key < 0 or public_key.bit_length() > PUBLIC_KEY_LENGTH * 8:
+            raise ValueError(f"Invalid public key: {hex(public_key)}")
+        return public_key.to_bytes(PUBLIC_KEY_LENGTH, "big")
+
+    if isinstance(public_key, (bytes, bytearray)):
+        public_key = public_key.decode("ascii")
+
+    if not isinstance(public_key, str):
+        raise ValueError(f"Invalid public key: {public_key}")
+
+    public_key = public_key.strip()
+    public_key_hex = public_key[2:] if public_key.lower().startswith("0x") else public_key
+    if len(public_key_hex) != PUBLIC_KEY_LENGTH * 2:
+        raise ValueError(f"Invalid public key: {public_key}")
+    return bytes.fromhex(public_key_hex)
+
+
+def format_public_key(public_key):
+    return "0x" + public_key.hex()
+
+
+def read_public_keys_file(public_keys_file):
+    """
+    Reads the public keys of a file (one per line, empty lines and "#" comments are ignored). The file is memory mapped,
+    so large files are not loaded in memory
+    """
+    with open(public_keys_file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b""):
+                line = line.split(b"#", 1)[0].strip()
+                if line:
+                    yield line
+
+
+def read_keystores_dir(keystores_dir):
+    """
+    Reads the public keys of the EIP-2335 keystores in a directory (i.e. the "validator_keys" of the deposit CLI)
+    """
+    for file_name in sorted(os.listdir(keystores_dir)):
+        if not file_name.endswith(".json"):
+            continue
+
+        with open(os.path.join(keystores_dir, file_name)) as f:
+            keystore = json.load(f)
+
+        # Skip other JSON files (i.e. the deposit data)
+        if isinstance(keystore, dict) and "pubkey" in keystore:
+            yield keystore["pubkey"]
+
+
+def get_mtime(path):
+    return os.stat(path).st_mtime if path is not None else None
+
+
+def load_public_keys(validators_conf):
+    """
+    Loads the public keys of the validators from the config ("public_keys"), a file ("public_keys_file") and a
+    directory of keystores ("keystores_dir"). Returns them normalized to 48 bytes, validated and without duplicates
+    """
+    global loaded_public_keys
+    config_public_keys = validators_conf.get("public_keys", None) or []
+    public_keys_file = validators_conf.get("public_keys_file", None)
+    keystores_dir = validators_conf.get("keystores_dir", None)
+    signature = (
+        public_keys_file,
+        get_mtime(public_keys_file),
+        keystores_dir,
+        get_mtime(keystores_dir),
+    )
+    if (
+        loaded_public_keys is not None
+        and loaded_public_keys[0] is config_public_keys
+        and loaded_public_keys[1] == signature
+    ):
+        return loaded_public_keys[2]
+
+    sources = [config_public_keys]
+    if public_keys_file is not None:
+        sources.append(read_public_keys_file(public_keys_file))
+    if keystores_dir is not None:
+        sources.append(read_keystores_dir(keystores_dir))
+
+    # Normalize and deduplicate (keeping the order)
+    public_keys = {}
+    invalid_public_keys = []
+    total = 0
+    for source in sources:
+        for public_key in source:
+            total += 1
+            try:
+                public_keys[normalize_public_key(public_key)] = None
+            except ValueError:
+                invalid_public_keys.append(public_key)
+
+    if invalid_public_keys:
+        log.warning(
+            f"Ignoring {len(invalid_public_keys)} invalid public keys: {invalid_public_keys[:MAX_INVALID_KEYS_LOGGED]}"
+        )
+    duplicates = total - len(invalid_public_keys) - len(public_keys)
+    if duplicates:
+        log.info(f"Ignoring {duplicates} duplicated public keys")
+
+    result = list(public_keys)
+    loaded_public_keys = (config_public_keys, signature, result)
+    return result
@@ -0,0 +1,218 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+import util.prometheus as prometheus
+import util.utils as utils
+
+log = utils.getLog(__name__)
+
+SERVICE_NAME = "eth2-monitor"
+
+# Sampling profiler
+PROFILE_INTERVAL_SECONDS = 0.005
+MAX_PROFILE_SECONDS = 300
+
+# Config
+enabled = False
+trace_file = None
+profile_seconds = 30
+profile_file = "profile.txt"
+
+# Trace of the current check (and the current span), shared with the threads doing the requests
+current_trace = contextvars.ContextVar("current_trace", default=None)
+current_span_id = contextvars.ContextVar("current_span_id", default=None)
+
+trace_file_lock = threading.Lock()
+profiler_lock = threading.Lock()
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add_span(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+
+def setup(profiling_config):
+    global enabled, trace_file, profile_seconds, profile_file
+    if profiling_config is None:
+        return
+
+    enabled = True
+    trace_file = profiling_config.get("trace_file", None)
+    profile_seconds = profiling_config.get("profile_seconds", profile_seconds)
+    profile_file = profiling_config.get("profile_file", profile_file)
+    log.info(
+        f"Profiling enabled. Span timings exported to Prometheus"
+        + (f" and {trace_file}" if trace_file else "")
+    )
+
+
+@contextlib.contextmanager
+def span(name):
+    """
+    Measures the time of a block of code. Reported to the "span_seconds" histogram, and added to the trace of the
+    current check
+    """
+    if not enabled:
+        yield
+        return
+
+    span_id = secrets.token_hex(8)
+    parent_span_id = current_span_id.get()
+    token = current_span_id.set(span_id)
+    start_time = time.time_ns()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        current_span_id.reset(token)
+        prometheus.span_time_histogram.labels(span=name).observe(duration)
+
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_span(
+                {
+                    "traceId": trace.trace_id,
+                    "spanId": span_id,
+                    "parentSpanId": parent_span_id or "",
+                    "name": name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(start_time),
+                    "endTimeUnixNano": str(start_time + int(duration * 1e9)),
+                }
+            )
+
+
+def traced(name):
+    """
+    Decorator measuring a function (or coroutine function) as a span
+    """
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextlib.contextmanager
+def trace_check():
+    """
+    Collects the spans of a check, and writes them to the trace file (OpenTelemetry JSON, one line per check)
+    """
+    if not enabled:
+        yield
+        return
+
+    trace = Trace()
+    token = current_trace.set(trace)
+    try:
+        with span("check"):
+            yield
+    finally:
+        current_trace.reset(token)
+        if trace_file is not None:
+            write_trace(trace)
+
+
+def write_trace(trace):
+    with trace.lock:
+        spans = list(trace.spans)
+
+    line = json.dumps(
+        {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": SERVICE_NAME},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+                }
+            ]
+        }
+    )
+    try:
+        with trace_file_lock, open(trace_file, "a") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        log.error(f"Error writing the trace to {trace_file}: {e}")
+
+
+def sample_stacks(seconds):
+    """
+    Samples the stacks of all the threads for some seconds. Returns them in the collapsed format (one line per stack
+    with the number of samples), which can be used to generate flame graphs
+    """
+    stacks = Counter()
+    profiler_thread_id = threading.get_ident()
+    end = time.monotonic() + min(seconds, MAX_PROFILE_SECONDS)
+    while time.monotonic() < end:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == profiler_thread_id:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            stacks[";".join(reversed(stack))] += 1
+        time.sleep(PROFILE_INTERVAL_SECONDS)
+
+    return "\n".join(f"{stack} {samples}" for stack, samples in stacks.most_common())
+
+
+def start_profiler():
+    """
+    Profiles the app in the background, and writes the result in the profile file
+    """
+
+    def profile():
+        if not profiler_lock.acquire(blocking=False):
+            log.warning("The profiler is already running")
+            return
+
+        try:
+            log.info(f"Profiling for {profile_seconds}s")
+            stacks = sample_stacks(profile_seconds)
+            with open(profile_file, "w") as f:
+                f.write(stacks + "\n")
+            log.info(f"Profile written in {profile_file}")
+        except Exception as e:
+            log.error(f"Error profiling: {e}")
+        finally:
+            profiler_lock.release()
+
+    threading.Thread(target=profile, daemon=True).start()
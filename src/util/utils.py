@@ -1,5 +1,9 @@
 import os
+import asyncio
+import contextvars
 import logging
+import threading
+import time
 from pathlib import Path
 import yaml
 
@@ -39,4 +43,94 @@ def escape_special_symbols(input_string, special_symbols):
     return input_string
 
 
-config = getConfig()
+async def run_in_thread(func, *args, **kwargs):
+    """
+    Runs a blocking function in a daemon thread without blocking the event loop. Unlike asyncio.to_thread, the
+    shutdown doesn't wait for the thread to finish (i.e. an in-flight request)
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    context = contextvars.copy_context()
+
+    def set_result(result, exception):
+        if future.done():
+            # The caller is not waiting anymore (i.e. it was cancelled)
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def run():
+        result, exception = None, None
+        try:
+            result = context.run(func, *args, **kwargs)
+        except Exception as e:
+            exception = e
+        try:
+            loop.call_soon_threadsafe(set_result, result, exception)
+        except RuntimeError:
+            # The event loop is already closed
+            pass
+
+    threading.Thread(target=run, daemon=True).start()
+    return await future
+
+
+class RateLimiter:
+    """
+    Spaces the requests of concurrent tasks at least "interval" seconds apart, so running them concurrently doesn't
+    increase the request rate
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_time = 0
+
+    async def wait(self):
+        now = time.monotonic()
+        start = max(now, self.next_time)
+        self.next_time = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+def load_config():
+    # Parse the config only once, the first time it's used
+    global config_cache, config_mtime
+    if config_cache is None:
+        config_mtime = get_config_mtime()
+        config_cache = getConfig()
+    return config_cache
+
+
+def get_config_mtime():
+    try:
+        return os.stat(CONFIG_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def reload_config():
+    """
+    Reloads the config if the file was modified. Returns the new config, or None if it didn't change
+    """
+    global config_cache, config_mtime
+    mtime = get_config_mtime()
+    if mtime is None or mtime == config_mtime:
+        return None
+
+    config_mtime = mtime
+    config_cache = getConfig()
+    return config_cache
+
+
+def __getattr__(name):
+    # Lazy "utils.config" attribute
+    if name == "config":
+        return load_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+config_cache = None
+config_mtime = None
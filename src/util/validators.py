@@ -1,71 +1,314 @@
+import asyncio
+import json
 import requests
-import util.utils as utils
+import threading
 import time
+import util.utils as utils
 import traceback
 import backoff
+import util.capture as capture
+import util.tracing as tracing
 import util.prometheus as prometheus
-
-# Config: Beacon chain base url
-base_url = utils.config.get("beacon_chain", {}).get("base_url", "https://gnosischa.in")
+import util.pubkeys as pubkeys
 
 log = utils.getLog(__name__)
 
+# Timeout for the requests to the Beacon Chain API (seconds)
+REQUEST_TIMEOUT = 30
+
+# Interval to log the progress of the backfill (seconds)
+BACKFILL_LOG_SECONDS = 5
+
+# HTTP clients and JSON decoders for the Beacon Chain API (see benchmark.py to choose one)
+HTTP_CLIENTS = ["requests", "session"]
+JSON_DECODERS = ["json", "orjson"]
+
+base_url = None
+http_client = None
+json_decoder = None
+
+# Resolved validators for the public keys (48 bytes) and eth1 accounts (so reloading the config only resolves the new ones)
+public_keys_index = {}
+
+# Public keys of the batches that failed in the last backfill (see "backfill_public_keys")
+failed_public_keys = []
+eth1_accounts_index = {}
+
+
+def get_base_url():
+    # Config: Beacon chain base url (read the first time it's used)
+    global base_url
+    if base_url is None:
+        base_url = utils.config.get("beacon_chain", {}).get(
+            "base_url", "https://gnosischa.in"
+        )
+    return base_url
+
+
+class SessionPool:
+    """
+    Lends a requests.Session to every request. requests.Session is not thread safe, and every request runs in its own
+    thread (see utils.run_in_thread), so a session is used by one request at a time and reused by the next ones (there
+    are as many sessions as concurrent requests)
+    """
+
+    def __init__(self):
+        self.sessions = []
+        self.lock = threading.Lock()
+
+    def get(self, *args, **kwargs):
+        with self.lock:
+            session = self.sessions.pop() if self.sessions else requests.Session()
+        try:
+            return session.get(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.sessions.append(session)
+
+
+def get_http_client():
+    # Config: HTTP client (read the first time it's used). "session" reuses the connections
+    global http_client
+    if http_client is None:
+        client = utils.config.get("beacon_chain", {}).get("http_client", "requests")
+        if client not in HTTP_CLIENTS:
+            raise Exception(
+                f'Unknown http_client "{client}". Use one of: {", ".join(HTTP_CLIENTS)}'
+            )
+        http_client = SessionPool() if client == "session" else requests
+    return http_client
+
+
+def get_json_decoder():
+    # Config: JSON decoder (read the first time it's used). "orjson" is optional
+    global json_decoder
+    if json_decoder is None:
+        decoder = utils.config.get("beacon_chain", {}).get("json_decoder", "json")
+        if decoder not in JSON_DECODERS:
+            raise Exception(
+                f'Unknown json_decoder "{decoder}". Use one of: {", ".join(JSON_DECODERS)}'
+            )
+        json_decoder = json.loads
+        if decoder == "orjson":
+            try:
+                import orjson
+
+                json_decoder = orjson.loads
+            except ImportError:
+                log.warning(
+                    'The "orjson" JSON decoder is not installed (pip install orjson). Using "json"'
+                )
+    return json_decoder
+
+
+def reset_config():
+    # Read the config again the next time it's used
+    global base_url, http_client, json_decoder
+    base_url, http_client, json_decoder = None, None, None
+
 
 def get_validator_url(index):
-    return f"{base_url}/validator/{str(index)}"
+    return f"{get_base_url()}/validator/{str(index)}"
 
 
 @backoff.on_exception(backoff.expo, Exception, max_time=120)
+@tracing.traced("get_json")
 def get_json(path, base_api="/api/v1"):
     prometheus.bc_http_request_counter.inc()
 
-    res = requests.get(f"{base_url}{base_api}{path}")
-    result = res.json()
+    if capture.replayer is not None:
+        # Replay mode: Get the response from the capture file
+        result = capture.replayer.get_json(base_api, path)
+    else:
+        result = request_json(path, base_api)
     prometheus.bc_http_request_success_counter.inc()
 
     return result
 
 
+def request_json(path, base_api):
+    started = time.time()
+    try:
+        res = get_http_client().get(
+            f"{get_base_url()}{base_api}{path}", timeout=REQUEST_TIMEOUT
+        )
+        with tracing.span("json_decode"):
+            result = get_json_decoder()(res.content)
+    except Exception as e:
+        if capture.recorder is not None:
+            capture.recorder.record(
+                base_api, path, started, time.time() - started, error=repr(e)
+            )
+        raise
+
+    if capture.recorder is not None:
+        capture.recorder.record(
+            base_api, path, started, time.time() - started, response=result
+        )
+
+    return result
+
+
 def get_validators_from_eth1_address(eth1_withdraw_account):
+    if eth1_withdraw_account in eth1_accounts_index:
+        return eth1_accounts_index[eth1_withdraw_account]
+
     res_json = get_json(f"/validator/eth1/{eth1_withdraw_account}")
-    return [validator["validatorindex"] for validator in res_json["data"]]
+    validators = [validator["validatorindex"] for validator in res_json["data"]]
+    eth1_accounts_index[eth1_withdraw_account] = validators
+    return validators
 
 
 def get_validators_from_public_keys(public_keys):
-    validators = []
-    for batch in utils.divide_list_in_batches(public_keys):
-        public_keys_params = ",".join([hex(pub) for pub in batch])
-        api_url = f"/validator/{public_keys_params}"
-        res_json = get_json(api_url)
-
-        if len(batch) == 1:
-            # Handle edge case. The API returns an object instead of an array when there's only one validator
-            if "validatorindex" not in res_json["data"]: 
-              error_message = f'Expected an object with property "validatorindex" for for property "data" of GET /{api_url}. API JSON Result: {res_json}'
-              raise Exception(error_message)
-        
-            validators.append(res_json["data"]['validatorindex'])
-            continue
-
-        # Make sure res_json["data"] is an array
-        if "data" not in res_json or not isinstance(res_json["data"], list):
-            error_message = f'Expected an array for property "data" of GET /{api_url}. API JSON Result: {res_json}'
-            raise Exception(error_message)
+    # Resolve only the public keys that were not resolved before
+    validators = [public_keys_index[pub] for pub in public_keys if pub in public_keys_index]
+    public_keys_to_resolve = [pub for pub in public_keys if pub not in public_keys_index]
+    if validators:
+        log.debug(
+            f"{len(validators)} public keys were already resolved. Resolving {len(public_keys_to_resolve)} public keys"
+        )
 
-        # Make sure validators have a "validatorindex" property
-        validators_info = res_json["data"]
-        if "validatorindex" not in validators_info[0]: 
-            error_message = f'Expected an object with property "validatorindex" for the validator items return in "data" property of GET /{api_url}. API JSON Result: {res_json}'
+    for batch in utils.divide_list_in_batches(public_keys_to_resolve):
+        validators += resolve_public_keys_batch(batch)
+
+    return validators
+
+
+def resolve_public_keys_batch(batch):
+    """
+    Resolves the validators for a batch of public keys (raises if the API response is not the expected one)
+    """
+    public_keys_params = ",".join([pubkeys.format_public_key(pub) for pub in batch])
+    api_url = f"/validator/{public_keys_params}"
+    res_json = get_json(api_url)
+
+    if len(batch) == 1:
+        # Handle edge case. The API returns an object instead of an array when there's only one validator
+        if "validatorindex" not in res_json["data"]:
+            error_message = f'Expected an object with property "validatorindex" for for property "data" of GET /{api_url}. API JSON Result: {res_json}'
             raise Exception(error_message)
 
-        validators_batch = [
-            validator["validatorindex"] for validator in validators_info
-        ]
-        validators += validators_batch
+        public_keys_index[batch[0]] = res_json["data"]["validatorindex"]
+        return [res_json["data"]["validatorindex"]]
+
+    # Make sure res_json["data"] is an array
+    if "data" not in res_json or not isinstance(res_json["data"], list):
+        error_message = f'Expected an array for property "data" of GET /{api_url}. API JSON Result: {res_json}'
+        raise Exception(error_message)
+
+    # Make sure validators have a "validatorindex" property
+    validators_info = res_json["data"]
+    if "validatorindex" not in validators_info[0]:
+        error_message = f'Expected an object with property "validatorindex" for the validator items return in "data" property of GET /{api_url}. API JSON Result: {res_json}'
+        raise Exception(error_message)
+
+    for validator in validators_info:
+        if "pubkey" in validator:
+            public_keys_index[pubkeys.normalize_public_key(validator["pubkey"])] = validator["validatorindex"]
+
+    return [validator["validatorindex"] for validator in validators_info]
+
+
+async def backfill_public_keys(public_keys, concurrency=4, batch_request_delay=0.2):
+    """
+    Resolves the public keys in concurrent batches (at most "concurrency" requests in flight, started at least the
+    batch request delay apart). Failed batches are logged and skipped, and their public keys kept in
+    "failed_public_keys" to retry them. The progress is logged and reported to Prometheus. Returns the resolved
+    validators
+    """
+    global failed_public_keys
+    public_keys_to_resolve = [pub for pub in public_keys if pub not in public_keys_index]
+    batches = list(utils.divide_list_in_batches(public_keys_to_resolve))
+    total = len(public_keys_to_resolve)
+    semaphore = asyncio.Semaphore(concurrency)
+    rate_limiter = utils.RateLimiter(batch_request_delay)
+    failed_batches = []
+    validators = [public_keys_index[pub] for pub in public_keys if pub in public_keys_index]
+    processed, failed = 0, 0
+    last_log = time.monotonic()
+
+    async def resolve_batch(batch):
+        nonlocal processed, failed, last_log
+        async with semaphore:
+            # Prevent rate limits (the delay applies to all the concurrent requests)
+            await rate_limiter.wait()
+            try:
+                validators.extend(
+                    await utils.run_in_thread(resolve_public_keys_batch, batch)
+                )
+            except Exception:
+                failed += len(batch)
+                failed_batches.append(batch)
+                log.error(traceback.format_exc())
+                log.error(f"Error resolving a batch of {len(batch)} public keys. Skipping it")
+            processed += len(batch)
+
+            # Report the progress
+            prometheus.backfill_progress_gauge.set(processed / total)
+            prometheus.backfill_failed_public_keys_gauge.set(failed)
+            if time.monotonic() - last_log >= BACKFILL_LOG_SECONDS or processed == total:
+                last_log = time.monotonic()
+                log.info(
+                    f"Resolved {processed - failed}/{total} public keys ({processed / total:.0%} done, {failed} failed)"
+                )
+
+    if batches:
+        log.info(
+            f"Resolving {total} public keys in {len(batches)} batches ({concurrency} at a time)"
+        )
+        await asyncio.gather(*[resolve_batch(batch) for batch in batches])
+    prometheus.backfill_progress_gauge.set(1)
+    failed_public_keys = [pub for batch in failed_batches for pub in batch]
 
     return validators
 
 
+async def backfill_validators(concurrency=4, batch_request_delay=0.2):
+    """
+    Resolves all the monitored validators on startup (see "backfill_public_keys")
+    """
+    validators_conf = utils.config.get("validators", {})
+
+    # Get validators by withdraw address
+    eth1_withdraw_account = validators_conf.get("eth1_withdraw_account", None)
+    validators1 = (
+        await utils.run_in_thread(
+            get_validators_from_eth1_address, eth1_withdraw_account
+        )
+        if eth1_withdraw_account is not None
+        else []
+    )
+
+    # Get validators by public keys
+    public_keys = await utils.run_in_thread(pubkeys.load_public_keys, validators_conf)
+    validators2 = await backfill_public_keys(
+        public_keys, concurrency, batch_request_delay
+    )
+
+    return sorted(set(validators1 + validators2))
+
+
+def get_resolved_validators():
+    """
+    Returns the monitored validators resolved so far, without doing any request
+    """
+    validators_conf = utils.config.get("validators", {})
+    eth1_withdraw_account = validators_conf.get("eth1_withdraw_account", None)
+    try:
+        public_keys = pubkeys.load_public_keys(validators_conf)
+    except Exception:
+        # i.e. the public keys file is missing (the backfill keeps retrying)
+        log.error(traceback.format_exc())
+        log.error("Error loading the public keys")
+        public_keys = []
+
+    unique_validators = set(eth1_accounts_index.get(eth1_withdraw_account, []))
+    unique_validators.update(
+        public_keys_index[pub] for pub in public_keys if pub in public_keys_index
+    )
+    return sorted(unique_validators)
+
+
 def get_validators():
     validators_conf = utils.config.get("validators", {})
 
@@ -78,10 +321,8 @@ def get_validators():
     )
 
     # Get validators by public keys
-    public_keys = validators_conf.get("public_keys", [])
-    validators2 = (
-        get_validators_from_public_keys(public_keys) if public_keys is not None else []
-    )
+    public_keys = pubkeys.load_public_keys(validators_conf)
+    validators2 = get_validators_from_public_keys(public_keys)
 
     # Return unique validators
     unique_validators = set(validators1)
@@ -95,14 +336,16 @@ def get_validators():
     return result
 
 
-def get_validators_state(validators, batch_request_delay=0.2):
+async def get_validators_state(validators, batch_request_delay=0.2):
     result = []
     for batch in utils.divide_list_in_batches(validators):
         validators_param = ",".join([str(index) for index in batch])
         try:
             # Get the status for the validators
-            res_json = get_json(
-                f"/validators?validators={validators_param}", base_api="/dashboard/data"
+            res_json = await utils.run_in_thread(
+                get_json,
+                f"/validators?validators={validators_param}",
+                base_api="/dashboard/data",
             )
 
             for data in res_json["data"]:
@@ -113,7 +356,7 @@ def get_validators_state(validators, batch_request_delay=0.2):
                 result.append({"index": index, "status": status})
 
             # Prevent rate limits
-            time.sleep(batch_request_delay)
+            await asyncio.sleep(batch_request_delay)
         except Exception as e:
             log.error(
                 "Error getting validators state: {validators_param}\n",
@@ -123,15 +366,15 @@ def get_validators_state(validators, batch_request_delay=0.2):
     return result
 
 
-def get_validators_effectiveness(validators, batch_request_delay=0.2):
+async def get_validators_effectiveness(validators, batch_request_delay=0.2):
     result = []
     for batch in utils.divide_list_in_batches(validators):
         validators_param = ",".join([str(index) for index in batch])
         try:
             # Get the status for the validators
             # i.e https://gnosischa.in/api/v1/validator/30000/attestationeffectiveness
-            res_json = get_json(
-                f"/validator/{validators_param}/attestationeffectiveness"
+            res_json = await utils.run_in_thread(
+                get_json, f"/validator/{validators_param}/attestationeffectiveness"
             )
 
             for data in res_json["data"]:
@@ -146,7 +389,7 @@ def get_validators_effectiveness(validators, batch_request_delay=0.2):
                 result.append({"index": index, "effectiveness": effectiveness})
 
             # Prevent rate limits
-            time.sleep(batch_request_delay)
+            await asyncio.sleep(batch_request_delay)
         except Exception as e:
             log.error(
                 "Error getting validators effectiveness: {validators_param}\n",
@@ -156,6 +399,48 @@ def get_validators_effectiveness(validators, batch_request_delay=0.2):
     return result
 
 
+def get_current_epoch():
+    res_json = get_json("/epoch/latest")
+    return res_json["data"]["epoch"]
+
+
+def get_epoch_slots(epoch):
+    # i.e https://beaconcha.in/api/v1/epoch/1000/slots
+    res_json = get_json(f"/epoch/{epoch}/slots")
+    return res_json["data"]
+
+
+def get_epoch_proposers(epoch):
+    return {slot["slot"]: slot["proposer"] for slot in get_epoch_slots(epoch)}
+
+
+def get_slot_status(slot):
+    res_json = get_json(f"/slot/{slot}")
+    return res_json["data"]["status"]
+
+
+def get_sync_committee(period="latest"):
+    res_json = get_json(f"/sync_committee/{period}")
+    return res_json["data"]
+
+
+def get_validators_activation_epoch(validators):
+    activation_epochs = {}
+    for batch in utils.divide_list_in_batches(validators):
+        validators_param = ",".join([str(index) for index in batch])
+        res_json = get_json(f"/validator/{validators_param}")
+
+        # The API returns an object instead of an array when there's only one validator
+        validators_info = res_json["data"]
+        if not isinstance(validators_info, list):
+            validators_info = [validators_info]
+
+        for validator in validators_info:
+            activation_epochs[validator["validatorindex"]] = validator["activationepoch"]
+
+    return activation_epochs
+
+
 def main():
     # validators = get_json(f"/validators/queue")
     # print(f"Response:\n{validators}")
@@ -169,14 +454,14 @@ def main():
             f"validators for ETH1 Address {eth1_withdraw_account} ({len(validators)}):\n{validators}"
         )
 
-    public_keys = validators_conf["public_keys"]
-    if public_keys is not None:
+    public_keys = pubkeys.load_public_keys(validators_conf)
+    if public_keys:
         validators = get_validators_from_public_keys(public_keys)
         print(
             f"validators for the {len(public_keys)} Public Keys: {len(validators)}:\n{validators}"
         )
 
-    states = get_validators_state(validators)
+    states = asyncio.run(get_validators_state(validators))
     print(f"States {len(states)}:\n{states}")
 
 